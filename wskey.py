@@ -3,6 +3,7 @@
 new Env('wskey转换');
 '''
 import socket  # 用于端口检测
+import signal  # 常驻模式信号
 import base64  # 用于编解码
 import json  # 用于Json解析
 import os  # 用于导入系统变量
@@ -10,27 +11,48 @@ import sys  # 实现 sys.exit
 import logging  # 用于日志输出
 import time  # 时间
 import re  # 正则过滤
+import codecs  # 增量解码
+import hashlib  # Cookie 指纹
+import sqlite3  # 账号状态库
 import hmac
+import random  # 退避抖动
 import struct
+import ctypes  # inotify
+import select  # 合并 inotify 事件
+import ctypes.util  # 查找 libc
+import io  # 回放响应体
+import threading  # 并发锁
+import heapq  # 账号优先队列
+import itertools  # 合并 wskey 来源
+import functools  # 装饰器
+import atexit  # 退出时写出统计
+import cProfile  # 性能分析
+import pstats  # 性能分析结果
+import tracemalloc  # 内存分配追踪
+from http.cookiejar import DefaultCookiePolicy  # Cookie 策略
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED  # 线程池
+from urllib.parse import urlparse  # 解析主机
 
 WSKEY_MODE = 0
 # 0 = Default / 1 = Debug!
 
-if "WSKEY_DEBUG" in os.environ or WSKEY_MODE:  # 判断调试模式变量
-    logging.basicConfig(level=logging.DEBUG, format='%(message)s')  # 设置日志为 Debug等级输出
-    logger = logging.getLogger(__name__)  # 主模块
-    logger.debug("\nDEBUG模式开启!\n")  # 消息输出
-else:  # 判断分支
-    logging.basicConfig(level=logging.INFO, format='%(message)s')  # Info级日志
-    logger = logging.getLogger(__name__)  # 主模块
+logger = logging.getLogger(__name__)  # 主模块
+if __name__ == '__main__':  # 作为脚本运行时配置日志 作为模块导入时不修改调用方的日志配置
+    if "WSKEY_DEBUG" in os.environ or WSKEY_MODE:  # 判断调试模式变量
+        logging.basicConfig(level=logging.DEBUG, format='%(message)s')  # 设置日志为 Debug等级输出
+        logger.debug("\nDEBUG模式开启!\n")  # 消息输出
+    else:  # 判断分支
+        logging.basicConfig(level=logging.INFO, format='%(message)s')  # Info级日志
 
 try:  # 异常捕捉
     import requests  # 导入HTTP模块
 except Exception as e:  # 异常捕捉
     logger.info(str(e) + "\n缺少requests模块, 请执行命令：pip3 install requests\n")  # 日志输出
+    if __name__ != '__main__':  # 作为模块导入 交给调用方
+        raise
     sys.exit(1)  # 退出脚本
-os.environ['no_proxy'] = '*'  # 禁用代理
-requests.packages.urllib3.disable_warnings()  # 抑制错误
+from requests.adapters import HTTPAdapter  # 连接池适配器
+from requests.structures import CaseInsensitiveDict  # 回放响应头
 try:  # 异常捕捉
     from notify import send  # 导入青龙消息通知模块
 except Exception as err:  # 异常捕捉
@@ -40,6 +62,964 @@ except Exception as err:  # 异常捕捉
 ver = 21212  # 版本号
 
 
+class WskeyError(Exception):  # 类 面板/云端/变量错误 作为模块使用时由调用方处理 脚本入口转为退出码 code
+    def __init__(self, message, code=1):
+        super().__init__(message)
+        self.code = code  # 退出码
+
+
+def env_num(name, default, cast=int):  # 方法 读取数字型系统变量 格式错误时使用默认值
+    value = os.environ.get(name, '').strip()  # 读取变量
+    if not value:  # 未设置
+        return default  # 返回默认值
+    try:  # 异常捕捉
+        return cast(value)  # 转换类型
+    except ValueError:  # 异常捕捉
+        logger.info("变量 {0} 格式错误, 使用默认值 {1}".format(name, default))  # 标准日志输出
+        return default  # 返回默认值
+
+
+class HostPacer:  # 类 按主机节流 同一主机两次请求之间至少间隔 interval 秒
+    def __init__(self, interval):
+        self.interval = interval  # 默认请求间隔
+        self.hosts = {}  # 主机 -> 单独设置的请求间隔
+        self.next_time = {}  # 主机 -> 下次允许请求的时间
+        self.lock = threading.Lock()  # 线程锁
+
+    def wait(self, url, proxy=None, interval=None):  # 方法 请求前调用 预约该主机的下一个时间片 经代理的请求按代理分别节流 interval 为本次指定的间隔
+        host = urlparse(url).netloc  # 取主机
+        interval = self.hosts.get(host, self.interval) if interval is None else interval  # 该主机的间隔
+        if interval <= 0:  # 未设置间隔
+            return  # 直接返回
+        key = host + '@' + proxy['name'] if proxy else host  # 节流 key
+        with self.lock:  # 加锁预约
+            now = time.time()  # 当前时间
+            slot = max(now, self.next_time.get(key, 0.0))  # 可用时间片
+            self.next_time[key] = slot + interval  # 顺延下一个时间片
+        if slot > now:  # 需要等待
+            time.sleep(slot - now)  # 休眠至时间片
+
+
+class AccountLog(logging.Filter):  # 类 并发模式下按账号缓冲日志 账号处理完后整段输出
+    def __init__(self):
+        super().__init__()
+        self.local = threading.local()  # 线程私有缓冲
+        self.lock = threading.Lock()  # 输出锁
+
+    def filter(self, record):  # 方法 缓冲中的线程暂存日志
+        records = getattr(self.local, 'records', None)  # 读取缓冲
+        if records is None:  # 未开启缓冲
+            return True  # 直接输出
+        records.append(record)  # 暂存
+        return False  # 暂不输出
+
+    def begin(self):  # 方法 开始缓冲
+        self.local.records = []
+
+    def end(self):  # 方法 结束缓冲并整段输出
+        records, self.local.records = self.local.records, None  # 取出缓冲
+        with self.lock:  # 加锁 防止与其他账号日志交错
+            for record in records:  # 逐条输出
+                logger.handle(record)
+
+
+class HttpPool:  # 类 按主机复用 Session 连接池 保持长连接
+    def __init__(self, size):
+        self.size = size  # 每个主机的连接池大小
+        self.sessions = {}  # 主机 -> Session
+        self.lock = threading.Lock()  # 线程锁
+
+    def session(self, url):  # 方法 取该主机的 Session 不存在时创建
+        host = urlparse(url).netloc  # 取主机
+        with self.lock:  # 加锁
+            sess = self.sessions.get(host)  # 已有 Session
+            if sess is None:  # 首次访问该主机
+                sess = requests.session()  # 新建 Session
+                adapter = (CassetteAdapter if cassette.mode else HTTPAdapter)(pool_connections=4, pool_maxsize=self.size)  # 连接池 按 verify 等参数区分的池各自保留 录制/回放模式经过磁带
+                sess.mount('http://', adapter)  # 挂载 HTTP
+                sess.mount('https://', adapter)  # 挂载 HTTPS
+                sess.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))  # 不保存 Cookie 避免账号之间串号
+                sess.hooks['response'].append(metrics.response)  # 记录接口耗时
+                self.sessions[host] = sess  # 缓存
+            return sess  # 返回 Session
+
+    def stats(self):  # 方法 连接复用统计 返回 {主机: (请求数, 新建连接数)}
+        result = {}  # 统计结果
+        with self.lock:  # 加锁
+            sessions = list(self.sessions.items())  # 复制列表
+        for host, sess in sessions:  # 遍历 Session
+            requests_count, connections = 0, 0  # 计数
+            for adapter in set(sess.adapters.values()):  # 遍历适配器
+                for manager in [adapter.poolmanager] + list(adapter.proxy_manager.values()):  # 直连与各代理的连接池
+                    pools = manager.pools  # urllib3 连接池
+                    for key in pools.keys():  # 遍历连接池
+                        pool = pools.get(key)
+                        if pool is not None:
+                            requests_count += pool.num_requests  # 请求数
+                            connections += pool.num_connections  # 新建连接数
+            result[host] = (requests_count, connections)
+        return result  # 返回统计
+
+    def report(self):  # 方法 调试模式输出连接复用统计
+        if not logger.isEnabledFor(logging.DEBUG):  # 非调试模式
+            return  # 返回
+        for host, (count, conns) in self.stats().items():  # 逐个主机输出
+            reused = count - conns if count > conns else 0  # 复用次数
+            logger.debug("{0}: 请求 {1} 次, 新建连接 {2} 个, 复用 {3} 次".format(host, count, conns, reused))  # 调试日志输出
+
+
+class Cassette:  # 类 HTTP 录制/回放磁带 录制时敏感值替换为加盐哈希占位符 回放时按 方法+主机+路径+账号 匹配
+    keep = ('name', 'functionId', 'User-Agent', 'retcode', 'code', 'message', 'msg', 'status', 'update', 'id', '_id',
+            'client', 'clientVersion', 'build', 'lang', 'networkType', 'partner', 'sdkVersion', 'timestamp')  # 原样保留的 Json 字段
+    secret_re = re.compile(r'(?<![A-Za-z_])((?:pt_key|pt_pin|wskey|pin|tokenKey|sign|uuid|st)=)([^;&\s"\']+)')  # Cookie / 查询参数中的敏感值
+    ident_re = re.compile(r'(?<![A-Za-z])(?:pt_pin|pin|tokenKey)=([^;&\s"\']+)')  # 请求对应的账号
+
+    def __init__(self):
+        self.mode = ''  # record / replay / 空为关闭
+        self.path = None  # 磁带文件
+        self.scale = 1.0  # 回放延迟倍数
+        self.salt = os.urandom(16)  # 占位符盐值 不写入磁带
+        self.entries = []  # 录制记录
+        self.wskeys = []  # 录制时的 JD_WSCK (已替换)
+        self.auth = {}  # 录制时的青龙账号 (已替换)
+        self.exact = {}  # (方法, 主机, 路径, 账号) -> 记录列表
+        self.route = {}  # (方法, 主机, 路径) -> 记录列表
+        self.lock = threading.Lock()  # 线程锁
+
+    def record(self, path):  # 方法 开始录制 退出时写入
+        self.mode, self.path = 'record', path
+        atexit.register(self.save)
+
+    def replay(self, path, scale):  # 方法 载入磁带开始回放
+        with open(path, "r") as file:  # 上下文管理
+            data = json.load(file)
+        self.mode, self.path, self.scale = 'replay', path, scale
+        self.wskeys, self.auth = data.get('wskeys', []), data.get('auth', {})
+        for entry in data.get('entries', []):  # 建立匹配索引
+            self.exact.setdefault((entry['method'], entry['host'], entry['path'], entry['ident']), []).append(entry)
+            self.route.setdefault((entry['method'], entry['host'], entry['path']), []).append(entry)
+        logger.info("回放模式: {0} 条记录, 延迟倍数 {1}\n".format(len(data.get('entries', [])), scale))  # 标准日志输出
+
+    def save(self):  # 方法 写入磁带
+        with self.lock:  # 加锁
+            data = {'version': 1, 'created': time.time(), 'wskeys': self.wskeys, 'auth': self.auth, 'entries': self.entries}
+        with open(self.path + '.tmp', "w") as file:  # 先写临时文件
+            json.dump(data, file, ensure_ascii=False)
+        os.replace(self.path + '.tmp', self.path)  # 替换
+        logger.info("已录制 {0} 条请求: {1}".format(len(data['entries']), self.path))  # 标准日志输出
+
+    def mask(self, value):  # 方法 敏感值 -> 占位符 同一值得到同一占位符 保留风控/失效标记
+        if value == 'xxx':  # 风控标记
+            return value
+        digest = hmac.new(self.salt, value.encode(), hashlib.sha256).hexdigest()[:16]  # 加盐哈希
+        return ('fake_' if 'fake' in value else '') + 's' + digest
+
+    def scrub(self, text):  # 方法 替换文本中的敏感值
+        return self.secret_re.sub(lambda m: m.group(1) + self.mask(m.group(2)), text)
+
+    def scrub_json(self, obj, key=None):  # 方法 替换 Json 中的敏感值 未列入保留的字符串整体替换
+        if isinstance(obj, dict):
+            return {k: self.scrub_json(v, k) for k, v in obj.items()}
+        if isinstance(obj, list):
+            return [self.scrub_json(v, key) for v in obj]
+        if not isinstance(obj, str) or key in self.keep or not obj:  # 数字/保留字段
+            return obj
+        return self.scrub(obj) if self.secret_re.search(obj) else self.mask(obj)
+
+    def ident(self, request, masked):  # 方法 请求对应的账号 (占位符)
+        body = request.body.decode(errors='replace') if isinstance(request.body, bytes) else str(request.body or '')
+        found = self.ident_re.search(' '.join((request.url, request.headers.get('Cookie', ''), body)))
+        if not found:  # 与账号无关的请求
+            return ''
+        return self.mask(found.group(1)) if masked else found.group(1)
+
+    def store(self, request, res, latency, error=None):  # 方法 录制一次请求 只保存响应与请求的路由 不保存请求头/请求体
+        url = urlparse(request.url)  # 解析地址
+        entry = {'method': request.method, 'host': url.netloc, 'path': url.path, 'ident': self.ident(request, True), 'latency': round(latency, 4)}
+        if error is not None:  # 请求异常
+            entry['error'] = type(error).__name__
+        else:  # 保存响应
+            try:  # Json 响应逐字段替换
+                body = json.dumps(self.scrub_json(json.loads(res.content)), ensure_ascii=False)
+            except ValueError:  # 其他响应按文本替换
+                body = self.scrub(res.content.decode('utf-8', errors='replace'))
+            headers = [(k, self.scrub(v)) for k, v in res.raw.headers.items() if k.lower() in ('content-type', 'location', 'set-cookie')]
+            entry.update({'status': res.status_code, 'headers': headers, 'body': body})
+        with self.lock:  # 加锁
+            self.entries.append(entry)
+
+    def match(self, request):  # 方法 取出匹配的记录 优先同一账号 其次同一路由 用尽后重复最后一条
+        url = urlparse(request.url)  # 解析地址
+        route = (request.method, url.netloc, url.path)
+        with self.lock:  # 加锁
+            for entries in (self.exact.get(route + (self.ident(request, False),)), self.route.get(route)):
+                for entry in entries or []:
+                    if not entry.get('used'):
+                        entry['used'] = True
+                        return entry
+            entries = self.route.get(route)
+            return entries[-1] if entries else None
+
+    def respond(self, request, entry):  # 方法 由记录生成响应
+        res = requests.Response()
+        body = entry.get('body', '').encode()
+        res.status_code, res.url, res.request, res.reason = entry['status'], request.url, request, ''
+        res.headers = CaseInsensitiveDict()
+        for k, v in entry.get('headers', []):  # 响应头 同名合并
+            res.headers[k] = res.headers[k] + ', ' + v if k in res.headers else v
+            if k.lower() == 'set-cookie':  # 响应 Cookie
+                name, _, value = v.split(';')[0].partition('=')
+                res.cookies.set(name.strip(), value.strip())
+        res.raw, res._content, res._content_consumed = io.BytesIO(body), body, True
+        res.encoding = requests.utils.get_encoding_from_headers(res.headers)
+        return res
+
+
+class CassetteAdapter(HTTPAdapter):  # 类 录制/回放适配器 所有经连接池的请求都经过磁带
+    def send(self, request, **kwargs):
+        if cassette.mode == 'replay':  # 回放
+            entry = cassette.match(request)  # 匹配记录
+            if entry is None:  # 未录制
+                raise requests.exceptions.ConnectionError("磁带中没有该请求: {0} {1}".format(request.method, urlparse(request.url).path))
+            if cassette.scale > 0:  # 按录制延迟等待
+                time.sleep(entry['latency'] * cassette.scale)
+            if 'error' in entry:  # 录制时请求异常
+                raise (requests.exceptions.Timeout if 'Timeout' in entry['error'] else requests.exceptions.ConnectionError)(entry['error'])
+            res = cassette.respond(request, entry)
+            res.connection = self
+            return res
+        start = time.time()  # 录制
+        try:  # 异常捕捉
+            res = super().send(request, **kwargs)
+            res.content  # 读取完整响应 流式读取时从已读内容产出
+        except Exception as err:  # 请求异常同样录制
+            cassette.store(request, None, time.time() - start, err)
+            raise
+        cassette.store(request, res, time.time() - start)
+        return res
+
+
+def http_request(method, url, pool=None, **kwargs):  # 方法 统一出站请求 使用按主机复用的连接池 pool 默认为全局连接池 响应耗时由 Session 钩子记录
+    start = time.time()  # 开始时间
+    try:  # 异常捕捉
+        return (pool or http_pool).session(url).request(method, url, **kwargs)  # 发送请求
+    except Exception:  # 超时/连接失败 没有响应 在此记录
+        metrics.observe('http', http_labels(method, url), time.time() - start, False)
+        raise
+
+
+class DiskCache:  # 类 本地 JSON 缓存 每项单独 TTL 过期后在宽限期内先返回旧值并后台刷新
+    def __init__(self, path):
+        self.path = path  # 缓存文件 None 为仅内存
+        self.data = {}  # key -> {'value': 值, 'time': 写入时间}
+        self.refreshing = set()  # 正在后台刷新的 key
+        self.lock = threading.Lock()  # 线程锁
+
+    def load(self, path):  # 方法 读取缓存文件
+        self.path = path  # 设置路径
+        if not path or not os.path.isfile(path):  # 无缓存文件
+            return  # 返回
+        try:  # 异常捕捉
+            with open(path, "r") as file:  # 上下文管理
+                data = json.load(file)  # 读取缓存
+        except Exception as err:  # 异常捕捉 缓存损坏时忽略
+            logger.debug(str(err))  # 调试日志输出
+            return  # 返回
+        with self.lock:  # 加锁
+            self.data = data if isinstance(data, dict) else {}  # 载入
+
+    def save(self):  # 方法 写入缓存文件 先写临时文件再替换 避免写坏
+        if not self.path:  # 仅内存
+            return  # 返回
+        with self.lock:  # 加锁
+            text = json.dumps(self.data)  # 序列化
+        try:  # 异常捕捉
+            tmp = self.path + '.tmp'  # 临时文件
+            with open(tmp, "w") as file:  # 上下文管理
+                file.write(text)  # 写入
+            os.replace(tmp, self.path)  # 原子替换
+        except Exception as err:  # 异常捕捉
+            logger.debug(str(err))  # 调试日志输出
+
+    def get(self, key, ttl):  # 方法 读取未过期的值 过期或不存在返回 None
+        with self.lock:  # 加锁
+            item = self.data.get(key)  # 缓存项
+        if item and time.time() - item['time'] < ttl:  # 未过期
+            return item['value']  # 返回值
+        return None  # 返回 None
+
+    def set(self, key, value):  # 方法 写入缓存
+        with self.lock:  # 加锁
+            self.data[key] = {'value': value, 'time': time.time()}  # 写入
+        self.save()  # 保存
+
+    def drop(self, key):  # 方法 删除缓存项
+        with self.lock:  # 加锁
+            if self.data.pop(key, None) is None:  # 不存在
+                return  # 返回
+        self.save()  # 保存
+
+    def fetch(self, key, loader, ttl, stale=0):  # 方法 读取缓存 未命中时调用 loader ttl 内直接返回 ttl + stale 内返回旧值并后台刷新
+        with self.lock:  # 加锁
+            item = self.data.get(key)  # 缓存项
+            item = item if item and item.get('value') else None  # 空值视为未命中 (旧版本可能写入了 null)
+            age = time.time() - item['time'] if item else None  # 缓存时长
+            if item and age < ttl:  # 未过期
+                return item['value']  # 返回缓存
+            if item and age < ttl + stale and key not in self.refreshing:  # 宽限期内 后台刷新
+                self.refreshing.add(key)  # 标记刷新
+                threading.Thread(target=profiler.wrap(self.refresh), args=(key, loader)).start()  # 后台刷新
+                return item['value']  # 先返回旧值
+            if item and age < ttl + stale:  # 已在刷新
+                return item['value']  # 返回旧值
+        value = loader()  # 同步加载
+        if value:  # 加载失败 (空值) 不写入缓存 下次重新加载
+            self.set(key, value)  # 写入缓存
+        return value  # 返回值
+
+    def refresh(self, key, loader):  # 方法 后台刷新缓存项 失败时保留旧值
+        try:  # 异常捕捉
+            value = loader()  # 加载
+            if value:  # 空值保留旧值
+                self.set(key, value)  # 写入
+        except Exception as err:  # 异常捕捉 包括 WskeyError
+            logger.debug("缓存 {0} 刷新失败: {1}".format(key, err))  # 调试日志输出
+        finally:  # 无论成功与否
+            with self.lock:  # 加锁
+                self.refreshing.discard(key)  # 取消标记
+
+
+class StateStore:  # 类 本地账号状态库 (SQLite) 按 pin 记录检查与转换结果 用于跳过未到期的账号
+    fields = ('last_success', 'last_check', 'last_valid', 'ck_fp', 'fail_count', 'last_token', 'last_attempt', 'ws_fp')  # 字段
+
+    def __init__(self):
+        self.db = None  # 数据库连接
+        self.lock = threading.Lock()  # 线程锁
+
+    def open(self, path):  # 方法 打开状态库 path 为 None 时仅内存
+        self.db = sqlite3.connect(path or ':memory:', check_same_thread=False, isolation_level=None)  # 自动提交
+        with self.lock:  # 加锁
+            if path:  # 文件数据库
+                self.db.execute("PRAGMA journal_mode=WAL")  # 写前日志
+                self.db.execute("PRAGMA synchronous=NORMAL")  # 降低同步开销
+            self.db.execute("""CREATE TABLE IF NOT EXISTS accounts (
+                pin TEXT PRIMARY KEY,
+                last_success REAL DEFAULT 0,
+                last_check REAL DEFAULT 0,
+                last_valid INTEGER DEFAULT 0,
+                ck_fp TEXT DEFAULT '',
+                fail_count INTEGER DEFAULT 0,
+                last_token TEXT DEFAULT '',
+                last_attempt REAL DEFAULT 0,
+                ws_fp TEXT DEFAULT ''
+            )""")  # 建表
+
+    def get(self, pin):  # 方法 读取账号状态 不存在返回 None
+        with self.lock:  # 加锁
+            row = self.db.execute("SELECT " + ', '.join(self.fields) + " FROM accounts WHERE pin = ?", (pin,)).fetchone()
+        return dict(zip(self.fields, row)) if row else None  # 返回 dict
+
+    def update(self, pin, **values):  # 方法 写入账号状态 不存在时新建
+        keys = list(values)  # 字段
+        with self.lock:  # 加锁
+            self.db.execute("INSERT OR IGNORE INTO accounts (pin) VALUES (?)", (pin,))  # 新建
+            self.db.execute("UPDATE accounts SET " + ', '.join(k + ' = ?' for k in keys) + " WHERE pin = ?",
+                            [values[k] for k in keys] + [pin])  # 更新
+
+    def record_seen(self, pin, ws_fp):  # 方法 记录已处理的 wskey 指纹 用于增量模式判断是否变化
+        self.update(pin, ws_fp=ws_fp)
+
+    def record_check(self, pin, ok, ck):  # 方法 记录有效性检查结果
+        self.update(pin, last_check=time.time(), last_valid=int(bool(ok)), ck_fp=ck_fp(ck))
+
+    def record_convert(self, pin, ok, ws_fp, token):  # 方法 记录转换结果 wskey 失效 (fake) 累计次数 成功清零 ws_fp 为 wskey 指纹
+        now = time.time()  # 当前时间
+        if ok:  # 转换成功
+            self.update(pin, last_success=now, fail_count=0, last_token=token, last_attempt=now, ws_fp=ws_fp)
+        elif token == 'fake':  # wskey 失效 按账号退避
+            row = self.get(pin) or {}  # 旧状态
+            self.update(pin, fail_count=row.get('fail_count', 0) + 1, last_token=token, last_attempt=now, ws_fp=ws_fp)
+        else:  # 云端/JD 接口问题 (params / risk / error) 不是账号的问题 不计入失败次数
+            self.update(pin, last_token=token, last_attempt=now, ws_fp=ws_fp)
+
+    def due(self, pin, ws_fp, ck):  # 方法 判断账号本次是否需要处理 ws_fp 为 wskey 指纹 返回 (bool, 原因)
+        row = self.get(pin)  # 账号状态
+        now = time.time()  # 当前时间
+        if not row:  # 首次处理
+            return True, ''
+        if row['ws_fp'] and row['ws_fp'] != ws_fp:  # wskey 已更换
+            return True, ''
+        if row['fail_count']:  # 连续失败 按次数指数退避
+            wait_time = min(env_num("WSKEY_FAIL_BACKOFF", 1800) * 2 ** (row['fail_count'] - 1), 86400)
+            if now - row['last_attempt'] < wait_time:
+                return False, "连续失败{0}次, {1}分钟后重试".format(row['fail_count'], int((wait_time - now + row['last_attempt']) / 60) + 1)
+            return True, ''
+        if ck and row['last_valid'] and row['ck_fp'] == ck_fp(ck) and now - row['last_check'] < env_num("WSKEY_CHECK_TTL", 1800):  # 近期检查有效
+            return False, "近期检查有效"
+        return True, ''
+
+
+class Backoff:  # 类 指数退避 等待时间 base * 2^attempt (不超过 cap) 的一半加随机抖动
+    def __init__(self, base, cap):
+        self.base = base  # 初始等待
+        self.cap = cap  # 最长等待
+
+    def delay(self, attempt):  # 方法 第 attempt 次重试前的等待秒数 attempt 从 0 开始
+        limit = min(self.cap, self.base * 2 ** attempt)  # 指数增长
+        return limit / 2 + random.uniform(0, limit / 2)  # 随机抖动 避免并发线程同时重试
+
+
+class CircuitBreaker:  # 类 熔断器 window 秒内风控/异常达到 threshold 次后暂停请求 cooldown 秒
+    def __init__(self, threshold, window, cooldown, cache=None):
+        self.cache = cache  # 保存熔断状态的本地缓存 None 为不保存
+        self.threshold = threshold  # 熔断阈值
+        self.window = window  # 统计窗口
+        self.cooldown = cooldown  # 熔断时长
+        self.failures = {}  # key -> 失败时间列表
+        self.open_until = {}  # key -> 熔断结束时间
+        self.half_open = {}  # 冷却结束后的 key -> 是否有试探请求进行中 同一时间只允许一个试探
+        self.cond = threading.Condition()  # 条件变量 试探结果给出后唤醒等待的请求
+
+    def allow(self, key, deadline=None):  # 方法 是否允许请求 冷却结束后只放行一个试探请求 其余请求等待 record / cancel 给出结果 最多等到 deadline
+        with self.cond:  # 加锁
+            while key in self.half_open:  # 试探阶段
+                if not self.half_open[key]:  # 没有进行中的试探
+                    self.half_open[key] = True  # 由本请求试探
+                    return True
+                timeout = deadline - time.time() if deadline is not None else None  # 等待上限
+                if timeout is not None and timeout <= 0:  # 时间预算用尽
+                    return False
+                self.cond.wait(timeout)  # 等待试探结果
+            until = self.open_until.get(key, 0)  # 熔断结束时间
+            if not until:  # 未熔断
+                return True
+            if time.time() < until:  # 熔断中
+                return False
+            del self.open_until[key]  # 冷却结束 进入试探
+            self.half_open[key] = True  # 由本请求试探
+            return True
+
+    def cancel(self, key):  # 方法 试探请求未得到接口结果 (如云端参数失败) 允许下一个请求试探
+        with self.cond:  # 加锁
+            if key in self.half_open:
+                self.half_open[key] = False
+                self.cond.notify_all()  # 唤醒等待的请求
+
+    def remaining(self, key):  # 方法 熔断剩余秒数
+        with self.cond:  # 加锁
+            return max(0, self.open_until.get(key, 0) - time.time())
+
+    def record(self, key, ok):  # 方法 记录请求结果
+        now = time.time()  # 当前时间
+        with self.cond:  # 加锁
+            self.cond.notify_all()  # 唤醒等待试探结果的请求 (锁释放后生效)
+            if ok:  # 成功 关闭熔断
+                self.half_open.pop(key, None)
+                self.failures.pop(key, None)
+                return
+            failures = [t for t in self.failures.get(key, []) if now - t < self.window] + [now]  # 窗口内失败
+            self.failures[key] = failures
+            if key in self.half_open or len(failures) >= self.threshold:  # 试探失败或达到阈值
+                self.half_open.pop(key, None)
+                self.failures.pop(key, None)
+                self.open_until[key] = now + self.cooldown  # 熔断
+                if self.cache is not None:  # 保存熔断状态 下次运行继续冷却
+                    self.cache.set('breaker', dict(self.open_until))
+                logger.info("JD接口风控/异常 {0} 次, 暂停请求 {1} 秒\n".format(len(failures), int(self.cooldown)))  # 标准日志输出
+
+
+class AdaptiveLimiter:  # 类 AIMD 自适应并发 接口正常时加性增加 风控/超时/异常时减半
+    def __init__(self, limit, minimum, maximum):
+        self.limit = float(limit)  # 当前并发上限
+        self.minimum = minimum  # 最小并发
+        self.maximum = maximum  # 最大并发
+        self.inflight = 0  # 进行中的转换数
+        self.last_cut = 0.0  # 最近一次减半的时间
+        self.shown = int(limit)  # 最近一次输出的上限
+        self.cond = threading.Condition()  # 条件变量
+
+    def acquire(self):  # 方法 等待空闲名额 返回开始时间
+        with self.cond:  # 加锁
+            while self.inflight >= int(self.limit):  # 达到上限
+                self.cond.wait()  # 等待释放
+            self.inflight += 1  # 占用名额
+            return time.time()  # 返回开始时间
+
+    def release(self, start, kind):  # 方法 释放名额并按结果调整上限 kind 为 account.kind 记录的转换结果
+        with self.cond:  # 加锁
+            self.inflight -= 1  # 释放名额
+            if kind in ('ok', 'fake'):  # 接口正常 每轮增加 1
+                self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            elif kind in ('risk', 'error') and start > self.last_cut:  # 减半后才开始的请求失败时再次减半
+                self.limit = max(self.minimum, self.limit / 2)
+                self.last_cut = time.time()
+            if int(self.limit) != self.shown:  # 上限变化时输出
+                self.shown = int(self.limit)
+                logger.info("JD转换并发上限调整为: {0}\n".format(self.shown))  # 标准日志输出
+            self.cond.notify_all()  # 唤醒等待线程
+
+
+class ProxyPool:  # 类 JD 出站代理池 按健康度与进行中请求数分配代理 风控冷却由熔断器按代理分别计算
+    def __init__(self):
+        self.proxies = []  # 代理列表 {'url', 'name', 'ok', 'fail', 'score', 'inflight'}
+        self.lock = threading.Lock()  # 线程锁
+
+    def load(self, text):  # 方法 由 WSKEY_PROXIES 载入代理 逗号/空白分隔 支持 http(s):// socks5(h)://
+        for url in re.split(r'[\s,&]+', text or ''):  # 遍历代理
+            if not url:  # 空值
+                continue
+            if '://' not in url:  # 未写协议默认 HTTP
+                url = 'http://' + url
+            parsed = urlparse(url)  # 解析地址
+            if parsed.scheme.startswith('socks'):  # SOCKS 代理需要 PySocks
+                try:  # 异常捕捉
+                    import socks  # noqa: F401
+                except ImportError:  # 未安装
+                    logger.info("未安装 PySocks, 忽略 SOCKS 代理: {0}".format(parsed.hostname))  # 标准日志输出
+                    continue
+            name = '{0}://{1}:{2}'.format(parsed.scheme, parsed.hostname, parsed.port or '')  # 不含账号密码的名称
+            self.proxies.append({'url': url, 'name': name, 'ok': 0, 'fail': 0, 'score': 1.0, 'inflight': 0})
+        if self.proxies:  # 输出代理数
+            logger.info("已载入 {0} 个代理\n".format(len(self.proxies)))  # 标准日志输出
+
+    def acquire(self, breaker):  # 方法 取一个代理 优先未冷却 (按 breaker 判断) 其次进行中请求最少 再次健康度最高 未配置代理返回 None
+        with self.lock:  # 加锁
+            if not self.proxies:  # 未配置代理
+                return None
+            proxy = min(self.proxies, key=lambda p: (breaker.remaining(proxy_key(p)) > 0, p['inflight'], -p['score']))
+            proxy['inflight'] += 1  # 占用
+            return proxy
+
+    def release(self, proxy, kind):  # 方法 归还代理并按结果更新健康度 kind 同 account.kind
+        if proxy is None:  # 直连
+            return
+        with self.lock:  # 加锁
+            proxy['inflight'] -= 1  # 释放
+            if kind in ('ok', 'fake'):  # 成功
+                proxy['ok'] += 1
+                proxy['score'] = proxy['score'] * 0.8 + 0.2  # 指数加权成功率
+            elif kind in ('risk', 'error'):  # 风控/异常
+                proxy['fail'] += 1
+                proxy['score'] = proxy['score'] * 0.8
+
+    def report(self):  # 方法 输出各代理的成功率与健康度
+        for proxy in self.proxies:  # 逐个代理输出
+            total = proxy['ok'] + proxy['fail']  # 请求数
+            logger.info("代理 {0}: 成功 {1} 次, 失败 {2} 次, 成功率 {3}%, 健康度 {4:.2f}".format(
+                proxy['name'], proxy['ok'], proxy['fail'], int(100 * proxy['ok'] / total) if total else 100, proxy['score']))  # 标准日志输出
+
+
+def proxy_key(proxy):  # 方法 代理对应的熔断 key 直连为 jd
+    return 'jd@' + proxy['name'] if proxy else 'jd'
+
+
+def proxy_args(proxy):  # 方法 requests 的 proxies 参数
+    return {'http': proxy['url'], 'https': proxy['url']} if proxy else None
+
+
+class EnvIndex:  # 类 JD_COOKIE 变量索引 按 pt_pin 精确检索 按变量 id 二级检索
+    def __init__(self):
+        self.by_pin = {}  # pt_pin -> 变量
+        self.by_id = {}  # 变量 id -> 变量
+        self.lock = threading.Lock()  # 线程锁
+
+    def load(self, envs, ql_id='id'):  # 方法 由青龙变量列表一次性建立索引 ql_id 为变量 id 键名
+        with self.lock:  # 加锁
+            self.by_pin.clear()  # 清空索引
+            self.by_id.clear()  # 清空索引
+            for env in envs:  # 遍历变量
+                if env.get("name") != "JD_COOKIE":  # 只索引 JD_COOKIE
+                    continue  # 继续循环
+                self._put(env[ql_id], env.get('value', ''), env.get('status', 0), False)  # 写入索引 重复 pin 保留第一个
+
+    def _put(self, e_id, value, status, replace):  # 方法 写入索引 调用方持锁
+        searchObj = pin_re.search(value)  # 正则检索 pt_pin
+        if not searchObj:  # 非标准 Cookie
+            return  # 忽略
+        pin = searchObj.group(1)  # 取值
+        old = self.by_id.get(e_id)  # 同 id 旧记录
+        if old and self.by_pin.get(old['pin']) is old:  # pin 发生变化时移除旧 pin
+            del self.by_pin[old['pin']]
+        env = {'pin': pin, 'value': value, 'id': e_id, 'status': status}  # 索引记录
+        self.by_id[e_id] = env  # 按 id 索引
+        if replace or pin not in self.by_pin:  # 按 pin 索引
+            self.by_pin[pin] = env
+
+    def put(self, e_id, value, status=0):  # 方法 新增或更新变量后同步索引
+        with self.lock:  # 加锁
+            self._put(e_id, value, status, True)  # 写入索引
+
+    def set_status(self, e_id, status):  # 方法 启用/禁用后同步状态 0 启用 1 禁用
+        with self.lock:  # 加锁
+            if e_id in self.by_id:  # 已索引
+                self.by_id[e_id]['status'] = status  # 更新状态
+
+    def get(self, pin):  # 方法 按 pt_pin 精确检索 返回记录或 None
+        with self.lock:  # 加锁
+            return self.by_pin.get(pin)
+
+
+class FileWatch:  # 类 监视文件变化 Linux 使用 inotify (ctypes) 不可用时按 interval 秒轮询
+    IN_MODIFY, IN_CLOSE_WRITE, IN_MOVED_TO, IN_CREATE = 0x2, 0x8, 0x80, 0x100  # inotify 事件
+
+    def __init__(self, paths, callback, interval=2.0):
+        self.paths = [os.path.abspath(path) for path in paths]  # 监视的文件
+        self.callback = callback  # 文件变化时调用
+        self.interval = interval  # 轮询间隔 / 合并连续事件的等待时间
+
+    def start(self):  # 方法 启动后台监视线程
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def run(self):  # 方法 优先 inotify 失败时轮询
+        try:  # 异常捕捉
+            self.inotify()
+        except Exception as err:  # 非 Linux / 无 libc / 监视数量超限
+            logger.debug(str(err))  # 调试日志输出
+            logger.info("inotify 不可用, 每 {0} 秒检查一次文件变化".format(self.interval))  # 标准日志输出
+            self.poll()
+
+    def inotify(self):  # 方法 监视文件所在目录 编辑器先写临时文件再替换时同样能收到事件
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)  # C 标准库
+        fd = libc.inotify_init1(os.O_CLOEXEC)  # 初始化
+        if fd < 0:  # 失败
+            raise OSError(ctypes.get_errno(), "inotify_init1")
+        mask = self.IN_MODIFY | self.IN_CLOSE_WRITE | self.IN_MOVED_TO | self.IN_CREATE  # 事件
+        names = {}  # wd -> 该目录下监视的文件名
+        for path in self.paths:  # 按目录添加监视
+            wd = libc.inotify_add_watch(fd, os.path.dirname(path).encode(), mask)
+            if wd < 0:  # 目录不存在等
+                raise OSError(ctypes.get_errno(), "inotify_add_watch " + os.path.dirname(path))
+            names.setdefault(wd, set()).add(os.path.basename(path).encode())
+        hit = False  # 是否有监视的文件变化
+        while True:  # 阻塞读取事件 变化后等待片刻 读完连续写入产生的事件再回调
+            if select.select([fd], [], [], min(self.interval, 0.5) if hit else None)[0]:
+                data, pos = os.read(fd, 65536), 0
+                while pos + 16 <= len(data):  # 逐个解析 struct inotify_event
+                    wd, _, _, length = struct.unpack_from('iIII', data, pos)
+                    hit = hit or data[pos + 16:pos + 16 + length].rstrip(b'\0') in names.get(wd, ())
+                    pos += 16 + length
+            elif hit:  # 事件已合并
+                hit = False
+                self.callback()
+
+    def poll(self):  # 方法 按 mtime / 大小轮询
+        def stamp():
+            result = []
+            for path in self.paths:
+                try:
+                    st = os.stat(path)
+                    result.append((st.st_mtime, st.st_size))
+                except OSError:  # 文件不存在
+                    result.append(None)
+            return result
+        last = stamp()
+        while True:  # 循环检查
+            time.sleep(self.interval)
+            now = stamp()
+            if now != last:  # 发生变化
+                last = now
+                self.callback()
+
+
+class Notifier:  # 类 通知队列 后台线程把消息合并为摘要发送 不阻塞转换流程
+    def __init__(self):
+        self.window = 0  # 摘要时间窗口 (秒) 0 为每轮运行发送一次
+        self.cond = threading.Condition()  # 条件变量
+        self.thread = None  # 发送线程
+        self.flushing = self.closing = False  # 立即发送 / 退出
+        self.messages, self.failed, self.totals, self.first = [], [], {}, None  # 待发送内容
+
+    def post(self, text, pin=None):  # 方法 加入一条消息 pin 为失效账号时只在摘要中列出 pin
+        with self.cond:  # 加锁
+            if pin is None:
+                self.messages.append(text)
+            else:
+                self.failed.append(pin)
+            self.first = self.first or time.time()  # 窗口开始时间
+            if self.thread is None:  # 首次使用时启动发送线程
+                self.thread = threading.Thread(target=self.run, daemon=True)
+                self.thread.start()
+            self.cond.notify_all()
+
+    def tally(self, kind):  # 方法 统计本期结果 ok / fail / new / valid
+        with self.cond:  # 加锁
+            self.totals[kind] = self.totals.get(kind, 0) + 1
+
+    def flush(self):  # 方法 立即发送已有内容 不等待发送完成
+        with self.cond:  # 加锁
+            self.flushing = True
+            if self.thread is None:  # 没有消息 只清空统计
+                self.totals, self.flushing = {}, False
+            self.cond.notify_all()
+
+    def close(self, timeout):  # 方法 退出前发送剩余内容 最多等待 timeout 秒
+        with self.cond:  # 加锁
+            if self.thread is None:
+                return
+            self.closing = True
+            self.cond.notify_all()
+        self.thread.join(timeout)
+
+    def digest(self):  # 方法 生成摘要 调用方持锁
+        totals = self.totals
+        lines = ["转换成功: {0}, 新增: {1}, 失效: {2}, 有效: {3}".format(
+            totals.get('ok', 0), totals.get('new', 0), totals.get('fail', 0), totals.get('valid', 0))]
+        if self.failed:  # 失效账号列表
+            lines.append("WsKey疑似失效 {0} 个: {1}".format(len(self.failed), ', '.join(self.failed)))
+        return '\n'.join(lines + self.messages)
+
+    def run(self):  # 方法 发送线程 收到 flush / 时间窗口到期 / 退出时发送
+        while True:  # 循环
+            with self.cond:  # 加锁
+                while not (self.flushing or self.closing or self.window > 0 and self.first and time.time() - self.first >= self.window):
+                    self.cond.wait(self.window - (time.time() - self.first) if self.window > 0 and self.first else None)
+                text = self.digest() if self.messages or self.failed else None  # 有消息时才发送
+                self.messages, self.failed, self.totals, self.first = [], [], {}, None
+                self.flushing, closing = False, self.closing
+            if text:  # 锁外发送 慢推送不阻塞新消息
+                deliver(text)
+            if closing:  # 退出
+                return
+
+
+class Account:  # 类 账号记录 每个账号只解析一次 在预检查/调度/转换/回写之间传递
+    __slots__ = ('ws', 'pin', 'ws_fp', 'eid', 'ck', 'updated', 'status', 'valid', 'kind', 'proxy')
+
+    def __init__(self, ws):
+        self.ws = ws  # wskey
+        self.pin = ws_pin(ws)  # pin 格式错误为 None
+        self.ws_fp = ck_fp(ws)  # wskey 指纹
+        self.eid = self.ck = self.updated = self.status = None  # 主面板 JD_COOKIE: 变量 id / Cookie / __time / 启用状态
+        self.valid = None  # 预检查结果 None 为未检查
+        self.kind = ''  # 最近一次转换结果 ok / fake / risk / error / params / open
+        self.proxy = None  # 本次转换使用的代理
+
+    @property
+    def label(self):  # 日志中的账号 pt_pin=xxx;
+        return 'pt_pin={0};'.format(self.pin)
+
+    def bind(self, env):  # 方法 关联主面板已有的 JD_COOKIE env 为 EnvIndex 记录或 None
+        if env is None:  # 新账号
+            self.eid = self.ck = self.updated = self.status = None
+            return
+        self.eid, self.ck, self.status = env['id'], env['value'], env.get('status', 0)
+        searchObj = time_re.search(self.ck)  # 正则检索 [__time=]
+        try:  # 异常捕捉
+            self.updated = float(searchObj.group(1)) if searchObj else None
+        except ValueError:  # 非数字
+            self.updated = None
+
+
+class AccountQueue:  # 类 账号优先队列 按 (到期时间, 失败次数) 出队 超出时间预算后停止出队
+    def __init__(self, items, deadline):
+        self.heap = [(due, fails, seq, account) for seq, (account, due, fails) in enumerate(items)]  # seq 保持同优先级原顺序
+        heapq.heapify(self.heap)  # 建堆
+        self.deadline = deadline  # 停止出队的时间戳 None 为不限制
+        self.skipped = 0  # 因超时未处理的账号数
+        self.lock = threading.Lock()  # 线程锁
+
+    def pop(self):  # 方法 取出最紧急的账号 队列为空或时间预算用尽返回 None
+        with self.lock:  # 加锁
+            if not self.heap:  # 队列为空
+                return None
+            if self.deadline is not None and time.time() >= self.deadline:  # 时间预算用尽
+                self.skipped += len(self.heap)  # 剩余账号留待下次
+                self.heap = []
+                return None
+            return heapq.heappop(self.heap)[-1]  # 返回账号
+
+    def stop(self):  # 方法 中止出队 收到退出信号/异常时调用 剩余账号留待下次运行
+        with self.lock:  # 加锁
+            self.skipped += len(self.heap)
+            self.heap = []
+
+
+class Metrics:  # 类 运行统计 按阶段/接口记录耗时直方图与成功失败计数 结束时输出 Prometheus 文本与 JSON 摘要
+    buckets = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)  # 直方图分桶 (秒)
+
+    def __init__(self):
+        self.start = time.time()  # 运行开始时间
+        self.series = {}  # (指标, 标签) -> {'count', 'success', 'failure', 'sum', 'max', 'buckets'}
+        self.counters = {}  # (指标, 标签) -> 计数
+        self.lock = threading.Lock()  # 线程锁
+
+    def observe(self, metric, labels, seconds, ok):  # 方法 记录一次耗时与结果 labels 为 ((名称, 值), ...)
+        with self.lock:  # 加锁
+            item = self.series.get((metric, labels))  # 已有记录
+            if item is None:  # 首次记录
+                item = self.series[(metric, labels)] = {'count': 0, 'success': 0, 'failure': 0, 'sum': 0.0, 'max': 0.0,
+                                                         'buckets': [0] * len(self.buckets)}
+            item['count'] += 1
+            item['success' if ok else 'failure'] += 1
+            item['sum'] += seconds
+            item['max'] = max(item['max'], seconds)
+            for i, bound in enumerate(self.buckets):  # 累计分桶
+                if seconds <= bound:
+                    item['buckets'][i] += 1
+
+    def count(self, metric, labels):  # 方法 计数器加一
+        with self.lock:  # 加锁
+            self.counters[(metric, labels)] = self.counters.get((metric, labels), 0) + 1
+
+    def response(self, res, *args, **kwargs):  # 方法 requests 响应钩子 按接口记录耗时
+        self.observe('http', http_labels(res.request.method, res.url), res.elapsed.total_seconds(), res.status_code < 400)
+
+    def prometheus(self):  # 方法 Prometheus 文本格式
+        names = {'phase': 'wskey_phase', 'http': 'wskey_http_request'}  # 指标名
+        lines = ['# TYPE wskey_run_duration_seconds gauge', 'wskey_run_duration_seconds {0:.3f}'.format(time.time() - self.start),
+                 '# TYPE wskey_run_timestamp_seconds gauge', 'wskey_run_timestamp_seconds {0:.0f}'.format(time.time())]
+        with self.lock:  # 加锁
+            series = sorted(self.series.items())  # 复制
+            counters = sorted(self.counters.items())
+        typed = set()  # 已输出 TYPE 的指标
+        for metric in sorted(set(m for (m, _), _ in series)):  # 同一指标的全部行连续输出
+            name = names[metric]
+            items = [(labels, item) for (m, labels), item in series if m == metric]  # 该指标的记录
+            lines.append('# TYPE {0}_duration_seconds histogram'.format(name))
+            for labels, item in items:  # 直方图
+                for bound, value in zip(self.buckets, item['buckets']):  # 分桶
+                    lines.append('{0}_duration_seconds_bucket{1} {2}'.format(name, prom_labels(labels + (('le', str(bound)),)), value))
+                lines.append('{0}_duration_seconds_bucket{1} {2}'.format(name, prom_labels(labels + (('le', '+Inf'),)), item['count']))
+                lines.append('{0}_duration_seconds_sum{1} {2:.6f}'.format(name, prom_labels(labels), item['sum']))
+                lines.append('{0}_duration_seconds_count{1} {2}'.format(name, prom_labels(labels), item['count']))
+            lines.append('# TYPE {0}_total counter'.format(name))
+            for labels, item in items:  # 成功/失败计数
+                for result in ('success', 'failure'):
+                    lines.append('{0}_total{1} {2}'.format(name, prom_labels(labels + (('result', result),)), item[result]))
+        for (metric, labels), value in counters:  # 其他计数器
+            if metric not in typed:
+                typed.add(metric)
+                lines.append('# TYPE {0} counter'.format(metric))
+            lines.append('{0}{1} {2}'.format(metric, prom_labels(labels), value))
+        return '\n'.join(lines) + '\n'
+
+    def summary(self):  # 方法 JSON 摘要
+        result = {'start': self.start, 'duration': round(time.time() - self.start, 3), 'phase': {}, 'http': {}, 'counters': {}}
+        with self.lock:  # 加锁
+            for (metric, labels), item in self.series.items():  # 按阶段/接口汇总
+                result[metric][' '.join(value for _, value in labels)] = {
+                    'count': item['count'], 'success': item['success'], 'failure': item['failure'],
+                    'total': round(item['sum'], 3), 'avg': round(item['sum'] / item['count'], 3), 'max': round(item['max'], 3)}
+            for (metric, labels), value in self.counters.items():  # 计数器
+                result['counters'][metric + ''.join('/' + value for _, value in labels)] = value
+        return result
+
+    def total(self, metric):  # 方法 某类记录的累计耗时
+        with self.lock:  # 加锁
+            return sum(item['sum'] for (m, _), item in self.series.items() if m == metric)
+
+    def write(self, prom_file, summary_file):  # 方法 写出统计文件 先写临时文件再替换 避免采集到半个文件
+        for path, text in ((prom_file, self.prometheus), (summary_file, lambda: json.dumps(self.summary(), ensure_ascii=False, indent=2))):
+            if not path:  # 未设置
+                continue
+            try:  # 异常捕捉
+                with open(path + '.tmp', "w") as file:  # 上下文管理
+                    file.write(text())
+                os.replace(path + '.tmp', path)  # 替换
+            except Exception as err:  # 异常捕捉
+                logger.info("统计文件写入失败: {0}".format(path))  # 标准日志输出
+                logger.debug(str(err))  # 调试日志输出
+
+
+class Profiler:  # 类 性能分析模式 主线程与工作线程分别采集 cProfile 结束时合并 同时记录内存分配
+    def __init__(self):
+        self.path = None  # pstats 输出文件 None 为未启用
+        self.main = None  # 主线程 Profile
+        self.threads = []  # 工作线程 Profile
+        self.lock = threading.Lock()  # 线程锁
+        self.wall = self.cpu = 0.0  # 开始时间
+
+    def start(self, path):  # 方法 开始采集
+        self.path = path  # 输出文件
+        self.wall, self.cpu = time.time(), time.process_time()  # 墙钟/CPU 时间
+        tracemalloc.start()  # 内存分配追踪
+        self.main = cProfile.Profile()  # 主线程 Profile
+        self.main.enable()
+
+    def wrap(self, func):  # 方法 工作线程入口包装 未启用时原样返回 无额外开销
+        if self.path is None:  # 未启用
+            return func
+
+        @functools.wraps(func)
+        def inner(*args, **kwargs):
+            prof = cProfile.Profile()  # 本线程 Profile
+            try:  # 异常捕捉
+                prof.enable()
+            except ValueError:  # 新版本 Python 中主线程 Profile 已覆盖全部线程
+                return func(*args, **kwargs)
+            try:  # 异常捕捉
+                return func(*args, **kwargs)
+            finally:  # 无论成功与否
+                prof.disable()
+                with self.lock:  # 加锁
+                    self.threads.append(prof)
+        return inner
+
+    def stop(self):  # 方法 结束采集并输出结果
+        if self.path is None:  # 未启用
+            return
+        self.main.disable()
+        wall, cpu = time.time() - self.wall, time.process_time() - self.cpu  # 墙钟/CPU 耗时
+        snapshot = tracemalloc.take_snapshot()  # 内存快照
+        tracemalloc.stop()
+        with self.lock:  # 加锁
+            stats = pstats.Stats(self.main, *self.threads)  # 合并各线程结果
+        stats.dump_stats(self.path)  # 写出 pstats
+        sleep = sum(v[2] for k, v in stats.stats.items() if k[2] in ("<built-in method time.sleep>", "<method 'acquire' of '_thread.lock' objects>"))  # 休眠与等待锁
+        net = metrics.total('http')  # 网络等待
+        logger.info("性能分析: 墙钟 {0:.2f} 秒, CPU {1:.2f} 秒, 网络等待 {2:.2f} 线程秒, 休眠/等待 {3:.2f} 线程秒, 线程数 {4}".format(
+            wall, cpu, net, sleep, len(self.threads) + 1))  # 标准日志输出
+        logger.info("pstats 已写入: {0}".format(self.path))  # 标准日志输出
+        lines = ["{0:>8.3f} {1:>8.3f} {2:>7} {3}".format(ct, tt, nc, pstats.func_std_string(func))
+                 for func, (cc, nc, tt, ct, callers) in sorted(stats.stats.items(), key=lambda item: -item[1][3])[:20]]  # 按累计耗时输出前 20 个函数
+        logger.info("累计耗时  自身耗时  调用次数  函数\n" + '\n'.join(lines))  # 标准日志输出
+        lines = ["{0:>8.1f} KiB {1:>6} 次 {2}".format(stat.size / 1024, stat.count, stat.traceback[0])
+                 for stat in snapshot.statistics('lineno')[:10]]  # 前 10 个内存分配位置
+        logger.info("内存分配  次数  位置\n" + '\n'.join(lines))  # 标准日志输出
+
+
+def http_labels(method, url):  # 方法 接口标签 (方法, 主机, 路径) 不含查询参数
+    parsed = urlparse(url)  # 解析地址
+    return (('method', method), ('host', parsed.netloc), ('path', parsed.path or '/'))
+
+
+def prom_labels(labels):  # 方法 Prometheus 标签格式
+    return '{' + ','.join('{0}="{1}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')) for k, v in labels) + '}'
+
+
+def timed(phase):  # 装饰器 记录阶段耗时 抛出异常/返回 False/返回 None/返回 (False, ...) 计为失败
+    def wrap(func):
+        @functools.wraps(func)
+        def inner(*args, **kwargs):
+            start, ok = time.time(), False  # 开始时间
+            try:  # 异常捕捉
+                result = func(*args, **kwargs)
+                ok = not (result is False or result is None or isinstance(result, tuple) and result and result[0] is False)
+                return result
+            finally:  # 无论成功与否
+                metrics.observe('phase', (('phase', phase),), time.time() - start, ok)
+        return inner
+    return wrap
+
+
+pin_re = re.compile(r'pt_pin=([^;\s]+)', re.M | re.I)  # 预编译 pt_pin 正则
+time_re = re.compile(r'__time=([^;\s]+)', re.M | re.I)  # 预编译 __time 正则
+ws_pin_re = re.compile(r'^(?:[^;]*?pt_)?pin=([^;\s]+)', re.I)  # 预编译 wskey 首段 pin 正则
+pacer = HostPacer(0)  # 全局主机节流 主函数中按并发数设置
+http_pool = HttpPool(10)  # 全局连接池 主函数中按并发数设置
+cache = DiskCache(None)  # 全局本地缓存 主函数中载入
+state = StateStore()  # 全局账号状态库 主函数中打开
+breaker = CircuitBreaker(5, 300, 600, cache)  # 全局 JD 接口熔断器 主函数中设置
+jd_backoff = Backoff(2, 60)  # JD 转换重试退避
+cloud_backoff = Backoff(1, 10)  # 云端参数重试退避
+limiter = AdaptiveLimiter(1, 1, 1)  # 全局 JD 转换自适应并发 主函数中按线程数设置
+mirror_lock = threading.Lock()  # 云端地址历史锁
+proxy_pool = ProxyPool()  # 全局 JD 出站代理池
+metrics = Metrics()  # 全局运行统计
+cassette = Cassette()  # 全局 HTTP 录制/回放 WSKEY_RECORD / WSKEY_REPLAY 启用
+notifier = Notifier()  # 全局通知队列
+profiler = Profiler()  # 全局性能分析 WSKEY_PROFILE 启用
+
 # def ql_2fa():
 #     ''' Demo
 #     if "WSKEY_TOKEN" in os.environ:
@@ -85,8 +1065,12 @@ def ttotp(key):
     return str(binary)[-6:].zfill(6)
 
 
-def ql_send(text):
-    if "WSKEY_SEND" in os.environ and os.environ["WSKEY_SEND"] == 'disable':
+def ql_send(text, pin=None):  # 方法 加入通知队列 由后台线程合并发送
+    notifier.post(text, pin)
+
+
+def deliver(text):  # 方法 发送一条通知 在通知线程中调用
+    if "WSKEY_SEND" in os.environ and os.environ["WSKEY_SEND"] == 'disable' or cassette.mode == 'replay':  # 回放模式不发送通知
         return True
     else:
         try:  # 异常捕捉
@@ -96,141 +1080,115 @@ def ql_send(text):
             logger.info("通知发送失败")  # 标准日志输出
 
 
-# 登录青龙 返回值 token
-def get_qltoken(username, password, twoFactorSecret):  # 方法 用于获取青龙 Token
-    logger.info("Token失效, 新登陆\n")  # 日志输出
-    if twoFactorSecret:
-        try:
-            twoCode = ttotp(twoFactorSecret)
-        except Exception as err:
-            logger.debug(str(err))  # Debug日志输出
-            logger.info("TOTP异常")
-            sys.exit(1)
-        url = ql_url + "api/user/login"  # 设置青龙地址 使用 format格式化自定义端口
-        payload = json.dumps({
-            'username': username,
-            'password': password
-        })  # HTTP请求载荷
-        headers = {
-            'Accept': 'application/json',
-            'Content-Type': 'application/json'
-        }  # HTTP请求头 设置为 Json格式
-        try:  # 异常捕捉
-            res = requests.post(url=url, headers=headers, data=payload)  # 使用 requests模块进行 HTTP POST请求
-            if res.status_code == 200 and res.json()["code"] == 420:
-                url = ql_url + 'api/user/two-factor/login'
-                data = json.dumps({
-                    "username": username,
-                    "password": password,
-                    "code": twoCode
-                })
-                res = requests.put(url=url, headers=headers, data=data)
-                if res.status_code == 200 and res.json()["code"] == 200:
-                    token = res.json()["data"]['token']  # 从 res.text 返回值中 取出 Token值
-                    return token
-                else:
-                    logger.info("两步校验失败\n")  # 日志输出
-                    sys.exit(1)
-            elif res.status_code == 200 and res.json()["code"] == 200:
-                token = res.json()["data"]['token']  # 从 res.text 返回值中 取出 Token值
-                return token
-        except Exception as err:
-            logger.debug(str(err))  # Debug日志输出
-            sys.exit(1)
-    else:
-        url = ql_url + 'api/user/login'
-        payload = {
-            'username': username,
-            'password': password
-        }  # HTTP请求载荷
-        payload = json.dumps(payload)  # json格式化载荷
-        headers = {
-            'Accept': 'application/json',
-            'Content-Type': 'application/json'
-        }  # HTTP请求头 设置为 Json格式
-        try:  # 异常捕捉
-            res = requests.post(url=url, headers=headers, data=payload)  # 使用 requests模块进行 HTTP POST请求
-            if res.status_code == 200 and res.json()["code"] == 200:
-                token = res.json()["data"]['token']  # 从 res.text 返回值中 取出 Token值
-                return token
-            else:
-                ql_send("青龙登录失败!")
-                sys.exit(1)  # 脚本退出
-        except Exception as err:
-            logger.debug(str(err))  # Debug日志输出
-            logger.info("使用旧版青龙登录接口")
-            url = ql_url + 'api/login'  # 设置青龙地址 使用 format格式化自定义端口
-            payload = {
-                'username': username,
-                'password': password
-            }  # HTTP请求载荷
-            payload = json.dumps(payload)  # json格式化载荷
-            headers = {
-                'Accept': 'application/json',
-                'Content-Type': 'application/json'
-            }  # HTTP请求头 设置为 Json格式
-            try:  # 异常捕捉
-                res = requests.post(url=url, headers=headers, data=payload)  # 使用 requests模块进行 HTTP POST请求
-                token = json.loads(res.text)["data"]['token']  # 从 res.text 返回值中 取出 Token值
-            except Exception as err:  # 异常捕捉
-                logger.debug(str(err))  # Debug日志输出
-                logger.info("青龙登录失败, 请检查面板状态!")  # 标准日志输出
-                ql_send('青龙登陆失败, 请检查面板状态.')
-                sys.exit(1)  # 脚本退出
-            else:  # 无异常执行分支
-                return token  # 返回 token值
-        # else:  # 无异常执行分支
-        #     return token  # 返回 token值
-
-
-# 返回值 Token
-def ql_login():  # 方法 青龙登录(获取Token 功能同上)
-    path = '/ql/config/auth.json'  # 设置青龙 auth文件地址
-    if not os.path.isfile(path):
-        path = '/ql/data/config/auth.json'  # 尝试设置青龙 auth 新版文件地址
-    if os.path.isfile(path):  # 进行文件真值判断
-        with open(path, "r") as file:  # 上下文管理
-            auth = file.read()  # 读取文件
-            file.close()  # 关闭文件
-        auth = json.loads(auth)  # 使用 json模块读取
-        username = auth["username"]  # 提取 username
-        password = auth["password"]  # 提取 password
-        token = auth["token"]  # 提取 authkey
-        try:
-            twoFactorSecret = auth["twoFactorSecret"]
-        except Exception as err:
-            logger.debug(str(err))  # Debug日志输出
-            twoFactorSecret = ''
-        if token == '':  # 判断 Token是否为空
-            return get_qltoken(username, password, twoFactorSecret)  # 调用方法 get_qltoken 传递 username & password
-        else:  # 判断分支
-            url = ql_url + 'api/user'  # 设置URL请求地址 使用 Format格式化端口
-            headers = {
-                'Authorization': 'Bearer {0}'.format(token),
-                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/94.0.4606.71 Safari/537.36 Edg/94.0.992.38'
-            }  # 设置用于 HTTP头
-            res = requests.get(url=url, headers=headers)  # 调用 request模块发送 get请求
-            if res.status_code == 200:  # 判断 HTTP返回状态码
-                return token  # 有效 返回 token
-            else:  # 判断分支
-                return get_qltoken(username, password, twoFactorSecret)  # 调用方法 get_qltoken 传递 username & password
-    else:  # 判断分支
-        logger.info("没有发现auth文件, 你这是青龙吗???")  # 输出标准日志
-        sys.exit(0)  # 脚本退出
+def ql_headers():  # 方法 青龙登录请求头
+    return {
+        'Accept': 'application/json',
+        'Content-Type': 'application/json'
+    }  # HTTP请求头 设置为 Json格式
+
+
+def jwt_exp(token):  # 方法 读取 JWT 中的过期时间 无法解析时按 WSKEY_TOKEN_TTL 估算
+    try:  # 异常捕捉
+        payload = token.split('.')[1]  # JWT 载荷
+        payload = json.loads(base64.urlsafe_b64decode(payload + '=' * (-len(payload) % 4)))  # 解码
+        return float(payload['exp'])  # 返回过期时间
+    except Exception as err:  # 异常捕捉
+        logger.debug(str(err))  # 调试日志输出
+        return time.time() + env_num("WSKEY_TOKEN_TTL", 3600)  # 估算过期时间
 
 
 # 返回值 list[wskey]
-def get_wskey():  # 方法 获取 wskey值 [系统变量传递]
-    if "JD_WSCK" in os.environ:  # 判断 JD_WSCK是否存在于环境变量
-        wskey_list = os.environ['JD_WSCK'].split('&')  # 读取系统变量 以 & 分割变量
+def get_wskey():  # 方法 获取 wskey值 [系统变量传递] 常驻模式读取青龙 env.sh 中的最新值 另可由 WSKEY_FILE 追加
+    if cassette.mode == 'replay' and "JD_WSCK" not in os.environ:  # 回放录制时的账号
+        return list(cassette.wskeys)
+    text = os.environ.get("JD_WSCK")  # 系统变量
+    if live_env:  # 常驻模式 进程环境变量不会随面板修改更新
+        text = env_file_wsck(text)
+    env_list = (ws.strip() for ws in text.split('&') if ws.strip()) if text is not None else ()  # 以 & 分割变量
+    wskey_list = dedup_wskeys(itertools.chain(env_list, read_wskey_file()))  # 追加外部 wskey 文件 同一 pin 保留最后出现的
+    if text is not None or wskey_list:  # 判断 JD_WSCK是否存在于环境变量
         if len(wskey_list) > 0:  # 判断 WSKEY 数量 大于 0 个
+            if cassette.mode == 'record':  # 录制账号 (已替换)
+                cassette.wskeys = [cassette.scrub(ws) for ws in wskey_list]
             return wskey_list  # 返回 WSKEY [LIST]
         else:  # 判断分支
             logger.info("JD_WSCK变量未启用")  # 标准日志输出
-            sys.exit(1)  # 脚本退出
+            raise WskeyError('JD_WSCK变量未启用')  # 中止 脚本入口转为退出码
     else:  # 判断分支
         logger.info("未添加JD_WSCK变量")  # 标准日志输出
-        sys.exit(0)  # 脚本退出
+        raise WskeyError('未添加JD_WSCK变量', 0)  # 中止 脚本入口转为退出码
+
+
+def env_file():  # 方法 青龙 env.sh 路径 可由 WSKEY_ENV_FILE 指定
+    if os.environ.get("WSKEY_ENV_FILE"):
+        return os.environ["WSKEY_ENV_FILE"]
+    for path in ('/ql/data/config/env.sh', '/ql/config/env.sh'):  # 新版 / 旧版
+        if os.path.isfile(path):
+            return path
+    return None
+
+
+def env_file_wsck(default):  # 方法 从 env.sh 读取 JD_WSCK 文件不存在或未设置时返回 default
+    path = env_file()  # 文件路径
+    if not path or not os.path.isfile(path):
+        return default
+    with open(path, "r", encoding='utf-8', errors='replace') as file:  # 上下文管理
+        found = re.findall(r'^\s*export\s+JD_WSCK=(["\']?)(.*?)\1\s*$', file.read(), re.M)  # 取最后一次赋值
+    return found[-1][1] if found else default
+
+
+def read_wskey_file(path=None):  # 方法 逐行读取 wskey 文件 默认为 WSKEY_FILE 为 - 时读取标准输入 不整体载入内存
+    global stdin_wskeys
+    path = os.environ.get("WSKEY_FILE") if path is None else path
+    if path == '-':  # 标准输入只能读取一次 常驻模式后续轮次使用首次读取的结果
+        if stdin_wskeys is None:
+            stdin_wskeys = dedup_wskeys(parse_wskey_lines(sys.stdin))
+        for ws in stdin_wskeys:
+            yield ws
+        return
+    if not path or not os.path.isfile(path):
+        return
+    with open(path, "r", encoding='utf-8', errors='replace') as file:  # 上下文管理
+        for ws in parse_wskey_lines(file):
+            yield ws
+
+
+def parse_wskey_lines(lines):  # 方法 逐行产出 wskey 每行一个或以 & 分隔 # 开头为注释 JSONL 行为字符串或 {"pin": ..., "wskey": ...}
+    for line in lines:
+        line = line.strip()
+        if not line or line.startswith('#'):  # 空行 / 注释
+            continue
+        if line[0] in '{"':  # JSONL
+            try:  # 异常捕捉
+                item = json.loads(line)
+            except ValueError as err:  # 格式错误 跳过该行
+                logger.debug(str(err))  # 调试日志输出
+                logger.info("wskey 文件中有无法解析的行, 已跳过")  # 标准日志输出
+                continue
+            if isinstance(item, dict):  # 对象 wskey 只有值时与 pin 拼接
+                ws = str(item.get('wskey') or item.get('ws') or '').strip()
+                if ws and 'pin=' not in ws and item.get('pin'):
+                    ws = 'pin={0};wskey={1};'.format(item['pin'], ws)
+            else:  # 字符串
+                ws = str(item).strip()
+            if ws:
+                yield ws
+            continue
+        for ws in line.split('&'):  # 以 & 分隔
+            if ws.strip():
+                yield ws.strip()
+
+
+def dedup_wskeys(items):  # 方法 按 pin 去重 同一 pin 保留最后出现 (最新) 的 wskey 并按最后出现的位置排序
+    latest, dup = {}, 0  # pin -> wskey / 重复数
+    for ws in items:
+        key = ws_pin(ws) or ws  # 格式错误的按原值去重 交给 process_ws 输出
+        if latest.pop(key, None) is not None:  # 重复 移到末尾
+            dup += 1
+        latest[key] = ws
+    if dup:  # 输出去重数
+        logger.info("去除重复 pin 的 wskey {0} 个, 保留最新的\n".format(dup))  # 标准日志输出
+    return list(latest.values())
 
 
 # 返回值 list[jd_cookie]
@@ -241,145 +1199,265 @@ def get_ck():  # 方法 获取 JD_COOKIE值 [系统变量传递] <! 此方法未
             return ck_list  # 返回 JD_COOKIE [LIST]
         else:  # 判断分支
             logger.info("JD_COOKIE变量未启用")  # 标准日志输出
-            sys.exit(1)  # 脚本退出
+            raise WskeyError('JD_COOKIE变量未启用')  # 中止 脚本入口转为退出码
     else:  # 判断分支
         logger.info("未添加JD_COOKIE变量")  # 标准日志输出
-        sys.exit(0)  # 脚本退出
+        raise WskeyError('未添加JD_COOKIE变量', 0)  # 中止 脚本入口转为退出码
 
 
-# 返回值 bool
-def check_ck(ck):  # 方法 检查 Cookie有效性 使用变量传递 单次调用
-    searchObj = re.search(r'pt_pin=([^;\s]+)', ck, re.M | re.I)  # 正则检索 pt_pin
-    if searchObj:  # 真值判断
-        pin = searchObj.group(1)  # 取值
-    else:  # 判断分支
-        pin = ck.split(";")[1]  # 取值 使用 ; 分割
-    if "WSKEY_UPDATE_HOUR" in os.environ:  # 判断 WSKEY_UPDATE_HOUR是否存在于环境变量
-        updateHour = 23  # 更新间隔23小时
-        if os.environ["WSKEY_UPDATE_HOUR"].isdigit():  # 检查是否为 DEC值
-            updateHour = int(os.environ["WSKEY_UPDATE_HOUR"])  # 使用 int化数字
-        nowTime = time.time()  # 获取时间戳 赋值
-        updatedAt = 0.0  # 赋值
-        searchObj = re.search(r'__time=([^;\s]+)', ck, re.M | re.I)  # 正则检索 [__time=]
-        if searchObj:  # 真值判断
-            updatedAt = float(searchObj.group(1))  # 取值 [float]类型
-        if nowTime - updatedAt >= (updateHour * 60 * 60) - (10 * 60):  # 判断时间操作
-            logger.info(str(pin) + ";即将到期或已过期\n")  # 标准日志输出
+class WskeyConverter:  # 类 wskey 转换 云端参数 / 有效性检查 / getToken -> appjmp 可在多个线程间共用
+    def __init__(self, pool=http_pool, pacer=pacer, breaker=breaker, limiter=limiter, proxies=proxy_pool, cache=cache):  # 默认使用全局连接池/节流/熔断/并发/代理/本地缓存
+        self.pool = pool  # 连接池
+        self.cache = cache  # 本地缓存 云端地址/参数
+        self.pacer = pacer  # 主机节流
+        self.breaker = breaker  # JD 接口熔断器
+        self.limiter = limiter  # 自适应并发
+        self.proxies = proxies  # 出站代理池
+        self.api_url = 'https://api.m.jd.com/'  # JD 转换接口地址 可由 WSKEY_JD_API_URL 覆盖
+        self.un_url = 'https://un.m.jd.com/'  # JD appjmp 接口地址 可由 WSKEY_JD_UN_URL 覆盖
+        self.me_url = 'https://me-api.jd.com/'  # JD 有效性检查接口地址 可由 WSKEY_JD_ME_URL 覆盖
+        self.cloud_interval = None  # 云端 genToken 请求间隔 None 使用主机节流默认间隔 可由 WSKEY_CLOUD_SLEEP 覆盖
+        self.fixed_cloud_url = ''  # 指定的云端地址 设置后跳过地址探测 可由 WSKEY_CLOUD_URL 覆盖
+        self.cloud_url = ''  # 云端地址 refresh 后可用
+        self.cloud_arg = {}  # 云端参数
+        self.ua = ''  # 云端下发的 User-Agent
+        self.lock = threading.Lock()  # 刷新锁 同一时间只刷新一次
+
+    def refresh(self, cloud_ttl):  # 方法 刷新云端地址与参数 缓存未过期时不发送请求
+        with self.lock:  # 加锁 其他线程读取的始终是完整的一组参数
+            if self.fixed_cloud_url:  # 指定云端地址 跳过地址探测
+                self.cloud_url = self.fixed_cloud_url.rstrip('/') + '/'
+            else:  # 判断分支
+                self.cloud_url = base64.b64decode(self.cache.fetch('cloud_url', lambda: check_cloud(self.pool, self.cache), cloud_ttl, 86400)).decode()  # 调用方法 [check_cloud] 优先使用缓存
+            cloud_arg = self.cache.fetch('cloud_arg', self.cloud_info, cloud_ttl, 86400)  # 调用方法 [cloud_info] 优先使用缓存
+            self.cloud_arg, self.ua = cloud_arg, cloud_arg['User-Agent']  # 设置 UA
+
+    def record(self, account, kind):  # 方法 记录账号的转换结果 并反馈给 JD 熔断器 使用代理时按代理分别熔断
+        account.kind = kind  # 记录结果
+        metrics.count('wskey_convert_total', (('kind', kind),))  # 按结果计数
+        key = proxy_key(account.proxy)  # 熔断 key
+        if kind in ('risk', 'error'):  # 风控或接口异常
+            self.breaker.record(key, False)
+        elif kind in ('ok', 'fake'):  # 接口正常响应
+            self.breaker.record(key, True)
+        else:  # 未请求 JD 接口 (params) 不影响熔断 试探名额交给下一个请求
+            self.breaker.cancel(key)
+
+    @timed('cloud_info')
+    def cloud_info(self):  # 方法 云端信息
+        url = self.cloud_url + 'api/check_api'  # 设置 URL地址 路由 [check_api]
+        for i in range(3):  # For循环 3次
+            try:  # 异常捕捉
+                headers = {"authorization": "Bearer Shizuku"}  # 设置 HTTP头
+                res = http_request('GET', url=url, verify=False, headers=headers, timeout=20, pool=self.pool).text  # HTTP[GET] 请求 超时 20秒
+            except requests.exceptions.ConnectTimeout:  # 异常捕捉
+                logger.info("\n获取云端参数超时, 正在重试!" + str(i))  # 标准日志输出
+                time.sleep(cloud_backoff.delay(i))  # 指数退避
+                continue  # 循环继续
+            except requests.exceptions.ReadTimeout:  # 异常捕捉
+                logger.info("\n获取云端参数超时, 正在重试!" + str(i))  # 标准日志输出
+                time.sleep(cloud_backoff.delay(i))  # 指数退避
+                continue  # 循环继续
+            except Exception as err:  # 异常捕捉
+                logger.info("\n未知错误云端, 退出脚本!")  # 标准日志输出
+                logger.debug(str(err))  # 调试日志输出
+                raise WskeyError('未知错误云端')  # 中止 脚本入口转为退出码
+            else:  # 分支判断
+                try:  # 异常捕捉
+                    c_info = json.loads(res)  # json读取参数
+                    if not isinstance(c_info, dict) or 'User-Agent' not in c_info:  # 缺少必需参数
+                        raise ValueError(res[:200])
+                except Exception as err:  # 异常捕捉
+                    logger.info("云端参数解析失败")  # 标准日志输出
+                    logger.debug(str(err))  # 调试日志输出
+                    raise WskeyError('云端参数解析失败')  # 中止 脚本入口转为退出码
+                else:  # 分支判断
+                    return c_info  # 返回 -> c_info
+        logger.info("\n获取云端参数失败, 退出脚本!")  # 标准日志输出
+        raise WskeyError('获取云端参数失败')  # 中止 重试用尽 不返回空参数
+
+    # 返回值 bool
+    @timed('check_ck')
+    def check(self, account):  # 方法 检查账号已有 Cookie 的有效性 单次调用 pin / __time 使用账号记录中已解析的值
+        pin, ck = account.pin, account.ck  # 账号 pin / Cookie
+        if "WSKEY_UPDATE_HOUR" in os.environ:  # 判断 WSKEY_UPDATE_HOUR是否存在于环境变量
+            updateHour = 23  # 更新间隔23小时
+            if os.environ["WSKEY_UPDATE_HOUR"].isdigit():  # 检查是否为 DEC值
+                updateHour = int(os.environ["WSKEY_UPDATE_HOUR"])  # 使用 int化数字
+            nowTime = time.time()  # 获取时间戳 赋值
+            updatedAt = account.updated or 0.0  # Cookie 中的 __time
+            if nowTime - updatedAt >= (updateHour * 60 * 60) - (10 * 60):  # 判断时间操作
+                logger.info(str(pin) + ";即将到期或已过期\n")  # 标准日志输出
+                return False  # 返回 Bool类型 False
+            else:  # 判断分支
+                remainingTime = (updateHour * 60 * 60) - (nowTime - updatedAt)  # 时间运算操作
+                hour = int(remainingTime / 60 / 60)  # 时间运算操作 [int]
+                minute = int((remainingTime % 3600) / 60)  # 时间运算操作 [int]
+                logger.info(str(pin) + ";未到期，{0}时{1}分后更新\n".format(hour, minute))  # 标准日志输出
+                return True  # 返回 Bool类型 True
+        elif "WSKEY_DISCHECK" in os.environ:  # 判断分支 WSKEY_DISCHECK 是否存在于系统变量
+            logger.info("不检查账号有效性\n--------------------\n")  # 标准日志输出
             return False  # 返回 Bool类型 False
         else:  # 判断分支
-            remainingTime = (updateHour * 60 * 60) - (nowTime - updatedAt)  # 时间运算操作
-            hour = int(remainingTime / 60 / 60)  # 时间运算操作 [int]
-            minute = int((remainingTime % 3600) / 60)  # 时间运算操作 [int]
-            logger.info(str(pin) + ";未到期，{0}时{1}分后更新\n".format(hour, minute))  # 标准日志输出
-            return True  # 返回 Bool类型 True
-    elif "WSKEY_DISCHECK" in os.environ:  # 判断分支 WSKEY_DISCHECK 是否存在于系统变量
-        logger.info("不检查账号有效性\n--------------------\n")  # 标准日志输出
-        return False  # 返回 Bool类型 False
-    else:  # 判断分支
-        url = 'https://me-api.jd.com/user_new/info/GetJDUserInfoUnion'  # 设置JD_API接口地址
+            url = self.me_url + 'user_new/info/GetJDUserInfoUnion'  # 设置JD_API接口地址
+            headers = {
+                'Cookie': ck,
+                'Referer': 'https://home.m.jd.com/myJd/home.action',
+                'user-agent': self.ua
+            }  # 设置 HTTP头
+            proxy = self.proxies.acquire(self.breaker)  # 出站代理
+            try:  # 异常捕捉
+                self.pacer.wait(url, proxy)  # 主机节流
+                res = http_request('GET', url=url, headers=headers, verify=False, timeout=10, allow_redirects=False, proxies=proxy_args(proxy), pool=self.pool)  # 进行 HTTP请求[GET] 超时 10秒
+            except Exception as err:  # 异常捕捉
+                self.proxies.release(proxy, 'error')  # 归还代理
+                logger.debug(str(err))  # 调试日志输出
+                logger.info("JD接口错误 请重试或者更换IP")  # 标准日志输出
+                return False  # 返回 Bool类型 False
+            else:  # 判断分支
+                self.proxies.release(proxy, 'ok' if res.status_code == 200 else 'error')  # 归还代理
+                if res.status_code == 200:  # 判断 JD_API 接口是否为 200 [HTTP_OK]
+                    try:  # 异常捕捉 风控页面等非 Json 响应只影响该账号
+                        code = int(json.loads(res.text)['retcode'])  # 使用 Json模块对返回数据取值 int([retcode])
+                    except (ValueError, KeyError, TypeError) as err:  # 无法判断 按失效处理
+                        logger.debug(str(err))  # 调试日志输出
+                        logger.info(str(pin) + ";JD接口返回格式错误, 按失效处理\n")  # 标准日志输出
+                        return False  # 返回 Bool类型 False
+                    if code == 0:  # 判断 code值
+                        logger.info(str(pin) + ";状态正常\n")  # 标准日志输出
+                        return True  # 返回 Bool类型 True
+                    else:  # 判断分支
+                        logger.info(str(pin) + ";状态失效\n")
+                        return False  # 返回 Bool类型 False
+                else:  # 判断分支
+                    logger.info("JD接口错误码: " + str(res.status_code))  # 标注日志输出
+                    return False  # 返回 Bool类型 False
+
+    @timed('gen_params')
+    def gen_params(self):  # 方法 从云端获取 genToken 参数
+        url = self.cloud_url + 'api/genToken'  # 设置云端服务器地址 路由为 genToken
+        header = {"User-Agent": self.ua}  # 设置 HTTP头
+        self.pacer.wait(url, interval=self.cloud_interval)  # 主机节流 云端请求不经代理 全部转换共用一个间隔
+        return http_request('GET', url=url, headers=header, verify=False, timeout=20, pool=self.pool).json()  # 设置 HTTP请求参数 超时 20秒 Json解析
+
+    def get_token(self, account):  # 方法 获取 Wskey转换使用的 Token 由 JD_API 返回 这里传递账号记录
+        proxy = account.proxy  # 本次转换使用的代理
+        if not self.breaker.allow(proxy_key(proxy), run_deadline()):  # JD 接口熔断中 不再发送请求 试探中时等待试探结果
+            remaining = self.breaker.remaining(proxy_key(proxy))  # 熔断剩余秒数
+            if remaining > 0:  # 熔断中
+                logger.info("JD接口熔断中, {0} 秒后恢复\n".format(int(remaining) + 1))  # 标准日志输出
+            else:  # 等待试探结果时时间预算用尽
+                logger.info("JD接口熔断试探中, 时间预算已用尽\n")  # 标准日志输出
+            account.kind = 'open'  # 记录结果
+            return None  # 返回 -> None
+        try:  # 异常捕捉
+            params_ttl = env_num("WSKEY_PARAMS_TTL", 0)  # genToken 参数复用时间 默认不复用
+            params = self.cache.fetch('gen_token', self.gen_params, params_ttl) if params_ttl > 0 else self.gen_params()  # 获取参数
+        except Exception as err:  # 异常捕捉
+            logger.info("Params参数获取失败")  # 标准日志输出
+            logger.debug(str(err))  # 调试日志输出
+            self.cache.drop('cloud_url')  # 云端地址可能已失效 下次运行重新检测
+            self.record(account, 'params')  # 记录结果
+            return None  # 返回 -> None
+        tokenKey = self.client_action(account, params)  # 请求 tokenKey
+        if tokenKey is None:  # 接口错误
+            return None  # 返回 -> None
+        return self.appjmp(account, tokenKey)  # 传递账号, Tokenkey 执行方法 [appjmp]
+
+    @timed('getToken')
+    def client_action(self, account, params):  # 方法 请求 JD client.action 返回 tokenKey 失败为 None 阶段耗时只包含该请求
+        proxy = account.proxy  # 本次转换使用的代理
         headers = {
-            'Cookie': ck,
-            'Referer': 'https://home.m.jd.com/myJd/home.action',
-            'user-agent': ua
+            'cookie': account.ws,
+            'content-type': 'application/x-www-form-urlencoded; charset=UTF-8',
+            'charset': 'UTF-8',
+            'accept-encoding': 'br,gzip,deflate',
+            'user-agent': self.ua
         }  # 设置 HTTP头
+        url = self.api_url + 'client.action'  # 设置 URL地址
+        data = 'body=%7B%22to%22%3A%22https%253a%252f%252fplogin.m.jd.com%252fjd-mlogin%252fstatic%252fhtml%252fappjmp_blank.html%22%7D&'  # 设置 POST 载荷
         try:  # 异常捕捉
-            res = requests.get(url=url, headers=headers, verify=False, timeout=10, allow_redirects=False)  # 进行 HTTP请求[GET] 超时 10秒
+            self.pacer.wait(url, proxy)  # 主机节流
+            res = http_request('POST', url=url, params=params, headers=headers, data=data, verify=False,
+                             timeout=10, proxies=proxy_args(proxy), pool=self.pool)  # HTTP请求 [POST] 超时 10秒
+            res_json = json.loads(res.text)  # Json模块 取值
+            tokenKey = res_json['tokenKey']  # 取出TokenKey
         except Exception as err:  # 异常捕捉
-            logger.debug(str(err))  # 调试日志输出
-            logger.info("JD接口错误 请重试或者更换IP")  # 标准日志输出
-            return False  # 返回 Bool类型 False
+            logger.info("JD_WSKEY接口抛出错误 尝试重试 更换IP")  # 标准日志输出
+            logger.info(str(err))  # 标注日志输出
+            self.record(account, 'error')  # 记录结果
+            return None  # 返回 -> None
         else:  # 判断分支
-            if res.status_code == 200:  # 判断 JD_API 接口是否为 200 [HTTP_OK]
-                code = int(json.loads(res.text)['retcode'])  # 使用 Json模块对返回数据取值 int([retcode])
-                if code == 0:  # 判断 code值
-                    logger.info(str(pin) + ";状态正常\n")  # 标准日志输出
-                    return True  # 返回 Bool类型 True
-                else:  # 判断分支
-                    logger.info(str(pin) + ";状态失效\n")
-                    return False  # 返回 Bool类型 False
-            else:  # 判断分支
-                logger.info("JD接口错误码: " + str(res.status_code))  # 标注日志输出
-                return False  # 返回 Bool类型 False
+            return tokenKey  # 返回 -> tokenKey
 
-
-# 返回值 bool jd_ck
-def getToken(wskey):  # 方法 获取 Wskey转换使用的 Token 由 JD_API 返回 这里传递 wskey
-    try:  # 异常捕捉
-        url = str(base64.b64decode(url_t).decode()) + 'api/genToken'  # 设置云端服务器地址 路由为 genToken
-        header = {"User-Agent": ua}  # 设置 HTTP头
-        params = requests.get(url=url, headers=header, verify=False, timeout=20).json()  # 设置 HTTP请求参数 超时 20秒 Json解析
-    except Exception as err:  # 异常捕捉
-        logger.info("Params参数获取失败")  # 标准日志输出
-        logger.debug(str(err))  # 调试日志输出
-        return False, wskey  # 返回 -> False[Bool], Wskey
-    headers = {
-        'cookie': wskey,
-        'content-type': 'application/x-www-form-urlencoded; charset=UTF-8',
-        'charset': 'UTF-8',
-        'accept-encoding': 'br,gzip,deflate',
-        'user-agent': ua
-    }  # 设置 HTTP头
-    url = 'https://api.m.jd.com/client.action'  # 设置 URL地址
-    data = 'body=%7B%22to%22%3A%22https%253a%252f%252fplogin.m.jd.com%252fjd-mlogin%252fstatic%252fhtml%252fappjmp_blank.html%22%7D&'  # 设置 POST 载荷
-    try:  # 异常捕捉
-        res = requests.post(url=url, params=params, headers=headers, data=data, verify=False,
-                            timeout=10)  # HTTP请求 [POST] 超时 10秒
-        res_json = json.loads(res.text)  # Json模块 取值
-        tokenKey = res_json['tokenKey']  # 取出TokenKey
-    except Exception as err:  # 异常捕捉
-        logger.info("JD_WSKEY接口抛出错误 尝试重试 更换IP")  # 标准日志输出
-        logger.info(str(err))  # 标注日志输出
-        return False, wskey  # 返回 -> False[Bool], Wskey
-    else:  # 判断分支
-        return appjmp(wskey, tokenKey)  # 传递 wskey, Tokenkey 执行方法 [appjmp]
-
-
-# 返回值 bool jd_ck
-def appjmp(wskey, tokenKey):  # 方法 传递 wskey & tokenKey
-    wskey = "pt_" + str(wskey.split(";")[0])  # 变量组合 使用 ; 分割变量 拼接 pt_
-    if tokenKey == 'xxx':  # 判断 tokenKey返回值
-        logger.info(str(wskey) + ";疑似IP风控等问题 默认为失效\n--------------------\n")  # 标准日志输出
-        return False, wskey  # 返回 -> False[Bool], Wskey
-    headers = {
-        'User-Agent': ua,
-        'accept': 'accept:text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,image/apng,*/*;q=0.8,application/signed-exchange;v=b3;q=0.9',
-        'x-requested-with': 'com.jingdong.app.mall'
-    }  # 设置 HTTP头
-    params = {
-        'tokenKey': tokenKey,
-        'to': 'https://plogin.m.jd.com/jd-mlogin/static/html/appjmp_blank.html'
-    }  # 设置 HTTP_URL 参数
-    url = 'https://un.m.jd.com/cgi-bin/app/appjmp'  # 设置 URL地址
-    try:  # 异常捕捉
-        res = requests.get(url=url, headers=headers, params=params, verify=False, allow_redirects=False,
-                           timeout=20)  # HTTP请求 [GET] 阻止跳转 超时 20秒
-    except Exception as err:  # 异常捕捉
-        logger.info("JD_appjmp 接口错误 请重试或者更换IP\n")  # 标准日志输出
-        logger.info(str(err))  # 标准日志输出
-        return False, wskey  # 返回 -> False[Bool], Wskey
-    else:  # 判断分支
+    # 返回值 jd_ck 失败为 None
+    @timed('appjmp')
+    def appjmp(self, account, tokenKey):  # 方法 传递账号 & tokenKey
+        if tokenKey == 'xxx':  # 判断 tokenKey返回值
+            logger.info(account.label + "疑似IP风控等问题 默认为失效\n--------------------\n")  # 标准日志输出
+            self.record(account, 'risk')  # 记录结果
+            return None  # 返回 -> None
+        headers = {
+            'User-Agent': self.ua,
+            'accept': 'accept:text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,image/apng,*/*;q=0.8,application/signed-exchange;v=b3;q=0.9',
+            'x-requested-with': 'com.jingdong.app.mall'
+        }  # 设置 HTTP头
+        params = {
+            'tokenKey': tokenKey,
+            'to': 'https://plogin.m.jd.com/jd-mlogin/static/html/appjmp_blank.html'
+        }  # 设置 HTTP_URL 参数
+        url = self.un_url + 'cgi-bin/app/appjmp'  # 设置 URL地址
         try:  # 异常捕捉
-            res_set = res.cookies.get_dict()  # 从res cookie取出
-            pt_key = 'pt_key=' + res_set['pt_key']  # 取值 [pt_key]
-            pt_pin = 'pt_pin=' + res_set['pt_pin']  # 取值 [pt_pin]
-            if "WSKEY_UPDATE_HOUR" in os.environ:  # 判断是否在系统变量中启用 WSKEY_UPDATE_HOUR
-                jd_ck = str(pt_key) + ';' + str(pt_pin) + ';__time=' + str(time.time()) + ';'  # 拼接变量
-            else:  # 判断分支
-                jd_ck = str(pt_key) + ';' + str(pt_pin) + ';'  # 拼接变量
+            proxy = account.proxy  # 与 getToken 使用同一代理
+            self.pacer.wait(url, proxy)  # 主机节流
+            res = http_request('GET', url=url, headers=headers, params=params, verify=False, allow_redirects=False,
+                           timeout=20, proxies=proxy_args(proxy), pool=self.pool)  # HTTP请求 [GET] 阻止跳转 超时 20秒
         except Exception as err:  # 异常捕捉
-            logger.info("JD_appjmp提取Cookie错误 请重试或者更换IP\n")  # 标准日志输出
+            logger.info("JD_appjmp 接口错误 请重试或者更换IP\n")  # 标准日志输出
             logger.info(str(err))  # 标准日志输出
-            return False, wskey  # 返回 -> False[Bool], Wskey
+            self.record(account, 'error')  # 记录结果
+            return None  # 返回 -> None
         else:  # 判断分支
-            if 'fake' in pt_key:  # 判断 pt_key中 是否存在fake
-                logger.info(str(wskey) + ";WsKey状态失效\n")  # 标准日志输出
-                return False, wskey  # 返回 -> False[Bool], Wskey
+            try:  # 异常捕捉
+                res_set = res.cookies.get_dict()  # 从res cookie取出
+                pt_key = 'pt_key=' + res_set['pt_key']  # 取值 [pt_key]
+                pt_pin = 'pt_pin=' + res_set['pt_pin']  # 取值 [pt_pin]
+                if "WSKEY_UPDATE_HOUR" in os.environ:  # 判断是否在系统变量中启用 WSKEY_UPDATE_HOUR
+                    jd_ck = str(pt_key) + ';' + str(pt_pin) + ';__time=' + str(time.time()) + ';'  # 拼接变量
+                else:  # 判断分支
+                    jd_ck = str(pt_key) + ';' + str(pt_pin) + ';'  # 拼接变量
+            except Exception as err:  # 异常捕捉
+                logger.info("JD_appjmp提取Cookie错误 请重试或者更换IP\n")  # 标准日志输出
+                logger.info(str(err))  # 标准日志输出
+                self.record(account, 'error')  # 记录结果
+                return None  # 返回 -> None
             else:  # 判断分支
-                logger.info(str(wskey) + ";WsKey状态正常\n")  # 标准日志输出
-                return True, jd_ck  # 返回 -> True[Bool], jd_ck
+                if 'fake' in pt_key:  # 判断 pt_key中 是否存在fake
+                    logger.info(account.label + "WsKey状态失效\n")  # 标准日志输出
+                    self.record(account, 'fake')  # 记录结果
+                    return None  # 返回 -> None
+                else:  # 判断分支
+                    logger.info(account.label + "WsKey状态正常\n")  # 标准日志输出
+                    self.record(account, 'ok')  # 记录结果
+                    return jd_ck  # 返回 -> jd_ck
+
+    def convert(self, account):  # 方法 在自适应并发名额内执行一次 getToken -> appjmp 转换 返回新 Cookie 失败为 None 结果记录在 account.kind
+        start = self.limiter.acquire()  # 等待名额
+        account.kind = ''  # 清空结果
+        account.proxy = self.proxies.acquire(self.breaker)  # 分配代理 未配置时直连
+        try:  # 异常捕捉
+            return self.get_token(account)  # 转换
+        except BaseException:  # 未记录结果的异常 释放试探名额
+            self.breaker.cancel(proxy_key(account.proxy))
+            raise
+        finally:  # 无论成功与否
+            self.proxies.release(account.proxy, account.kind)  # 归还代理
+            self.limiter.release(start, account.kind)  # 按结果调整并发
+            account.proxy = None  # 代理已归还
 
 
-def update():  # 方法 脚本更新模块
+
+def update(cloud_arg):  # 方法 脚本更新模块 传递云端参数
     up_ver = int(cloud_arg['update'])  # 云端参数取值 [int]
     if ver >= up_ver:  # 判断版本号大小
         logger.info("当前脚本版本: " + str(ver))  # 标准日志输出
@@ -407,140 +1485,566 @@ def ql_check(port):  # 方法 检查青龙端口
         return True  # 返回 -> True[Bool]
 
 
-def serch_ck(pin):  # 方法 搜索 Pin
-    for i in range(len(envlist)):  # For循环 变量[envlist]的数量
-        if "name" not in envlist[i] or envlist[i]["name"] != "JD_COOKIE":  # 判断 envlist内容
-            continue  # 继续循环
-        if pin in envlist[i]['value']:  # 判断envlist取值['value']
-            value = envlist[i]['value']  # 取值['value']
-            id = envlist[i][ql_id]  # 取值 [ql_id](变量)
-            logger.info(str(pin) + "检索成功\n")  # 标准日志输出
-            return True, value, id  # 返回 -> True[Bool], value, id
-        else:  # 判断分支
-            continue  # 继续循环
-    logger.info(str(pin) + "检索失败\n")  # 标准日志输出
-    return False, 1  # 返回 -> False[Bool], 1
+class JsonStream:  # 类 增量解析 JSON 响应 内存中只保留当前读取的对象
+    def __init__(self, res, chunk_size=65536):
+        self.chunks = res.iter_content(chunk_size)  # 分块读取
+        self.text = codecs.getincrementaldecoder('utf-8')()  # 增量 UTF-8 解码
+        self.decoder = json.JSONDecoder()  # JSON 解码器
+        self.buf = ''  # 未解析的文本
+        self.pos = 0  # 解析位置
+        self.eof = False  # 是否读完
+        self.found = False  # items 是否读到 key 数组
+        self.fields = {}  # items 读到的顶层标量字段 (如 code / message)
 
+    def fill(self):  # 方法 读取下一块 返回是否读到数据
+        if self.eof:  # 已读完
+            return False  # 返回 -> False
+        chunk = next(self.chunks, None)  # 下一块
+        self.eof = chunk is None  # 是否读完
+        self.buf = self.buf[self.pos:] + self.text.decode(chunk or b'', self.eof)  # 丢弃已解析部分
+        self.pos = 0  # 重置位置
+        return not self.eof  # 返回是否读到数据
 
-def get_env():  # 方法 读取变量
-    url = ql_url + 'api/envs'
-    try:  # 异常捕捉
-        res = s.get(url)  # HTTP请求 [GET] 使用 session
-    except Exception as err:  # 异常捕捉
-        logger.debug(str(err))  # 调试日志输出
-        logger.info("\n青龙环境接口错误")  # 标准日志输出
-        sys.exit(1)  # 脚本退出
-    else:  # 判断分支
-        data = json.loads(res.text)['data']  # 使用Json模块提取值[data]
-        return data  # 返回 -> data
+    def peek(self):  # 方法 跳过空白 返回下一个字符
+        while True:  # 循环读取
+            while self.pos < len(self.buf) and self.buf[self.pos] in ' \t\r\n':  # 跳过空白
+                self.pos += 1
+            if self.pos < len(self.buf):  # 有字符
+                return self.buf[self.pos]  # 返回字符
+            if not self.fill():  # 无更多数据
+                raise ValueError("JSON 数据不完整")  # 抛出异常
 
+    def expect(self, char):  # 方法 读取指定字符
+        if self.peek() != char:  # 字符不符
+            raise ValueError("JSON 格式错误: 需要 " + char)  # 抛出异常
+        self.pos += 1  # 前进
 
-def check_id():  # 方法 兼容青龙老版本与新版本 id & _id的问题
-    url = ql_url + 'api/envs'
-    try:  # 异常捕捉
-        res = s.get(url).json()  # HTTP[GET] 请求 使用 session
-    except Exception as err:  # 异常捕捉
-        logger.debug(str(err))  # 调试日志输出
-        logger.info("\n青龙环境接口错误")  # 标准日志输出
-        sys.exit(1)  # 脚本退出
-    else:  # 判断分支
-        if '_id' in res['data'][0]:  # 判断 [_id]
-            logger.info("使用 _id 键值")  # 标准日志输出
-            return '_id'  # 返回 -> '_id'
-        else:  # 判断分支
-            logger.info("使用 id 键值")  # 标准日志输出
-            return 'id'  # 返回 -> 'id'
+    def value(self):  # 方法 解析一个完整的值
+        self.peek()  # 跳过空白
+        while True:  # 数据不完整时继续读取
+            try:  # 异常捕捉
+                obj, end = self.decoder.raw_decode(self.buf, self.pos)  # 解析
+                rest = self.buf[end:]  # 值之后的字符
+                if isinstance(obj, (int, float)) and not isinstance(obj, bool):  # 数字可能在块边界被截断
+                    rest = rest.lstrip('0123456789.eE+-')
+                if rest or self.eof:  # 值之后还有其他字符 说明值完整
+                    self.pos = end  # 前进
+                    return obj  # 返回值
+            except ValueError:  # 数据不完整
+                if self.eof:  # 已读完
+                    raise  # 抛出异常
+            self.fill()  # 读取更多数据
 
+    def items(self, key):  # 方法 逐个产出顶层对象中 key 数组的元素 读完后 found 表示是否存在该数组 其他顶层标量记录在 fields
+        self.expect('{')  # 顶层对象
+        while self.peek() != '}':  # 遍历键
+            name = self.value()  # 键名
+            self.expect(':')  # 冒号
+            if name == key and self.peek() == '[':  # 目标数组
+                self.found = True  # 存在目标数组
+                self.pos += 1  # 进入数组
+                while self.peek() != ']':  # 遍历元素
+                    yield self.value()  # 产出元素
+                    if self.peek() == ',':  # 分隔符
+                        self.pos += 1
+                self.pos += 1  # 离开数组
+            else:  # 其他键 只保留标量
+                value = self.value()
+                if not isinstance(value, (dict, list)):
+                    self.fields[name] = value
+            if self.peek() == ',':  # 分隔符
+                self.pos += 1
 
-def ql_update(e_id, n_ck):  # 方法 青龙更新变量 传递 id cookie
-    url = ql_url + 'api/envs'
-    data = {
-        "name": "JD_COOKIE",
-        "value": n_ck,
-        ql_id: e_id
-    }  # 设置 HTTP POST 载荷
-    data = json.dumps(data)  # json模块格式化
-    s.put(url=url, data=data)  # HTTP [PUT] 请求 使用 session
-    ql_enable(eid)  # 调用方法 ql_enable 传递 eid
-
-
-def ql_enable(e_id):  # 方法 青龙变量启用 传递值 eid
-    url = ql_url + 'api/envs/enable'
-    data = '["{0}"]'.format(e_id)  # 格式化 POST 载荷
-    res = json.loads(s.put(url=url, data=data).text)  # json模块读取 HTTP[PUT] 的返回值
-    if res['code'] == 200:  # 判断返回值为 200
-        logger.info("\n账号启用\n--------------------\n")  # 标准日志输出
-        return True  # 返回 ->True
-    else:  # 判断分支
-        logger.info("\n账号启用失败\n--------------------\n")  # 标准日志输出
-        return False  # 返回 -> Fasle
 
+class WriteBack:  # 类 青龙回写缓冲 启用/禁用/新增合并为批量请求
+    def __init__(self, client, size):
+        self.client = client  # 所属面板
+        self.size = size  # 每处理 size 个账号提交一次 0 为运行结束时统一提交
+        self.updates = {}  # 变量 id -> 新 Cookie
+        self.states = {}  # 变量 id -> enable / disable 同一 id 以最后一次为准
+        self.inserts = {}  # pt_pin -> 新 Cookie
+        self.count = 0  # 已处理账号数
+        self.lock = threading.Lock()  # 缓冲锁
+        self.flush_lock = threading.Lock()  # 提交锁 同一时间只提交一批
 
-def ql_disable(e_id):  # 方法 青龙变量禁用 传递 eid
-    url = ql_url + 'api/envs/disable'
-    data = '["{0}"]'.format(e_id)  # 格式化 POST 载荷
-    res = json.loads(s.put(url=url, data=data).text)  # json模块读取 HTTP[PUT] 的返回值
-    if res['code'] == 200:  # 判断返回值为 200
-        logger.info("\n账号禁用成功\n--------------------\n")  # 标准日志输出
-        return True  # 返回 ->True
-    else:  # 判断分支
-        logger.info("\n账号禁用失败\n--------------------\n")  # 标准日志输出
-        return False  # 返回 -> Fasle
+    def update(self, e_id, n_ck):  # 方法 更新变量并启用
+        with self.lock:
+            self.updates[e_id] = n_ck
+            self.states[e_id] = 'enable'
+
+    def enable(self, e_id):  # 方法 启用变量
+        with self.lock:
+            self.states[e_id] = 'enable'
+
+    def disable(self, e_id):  # 方法 禁用变量
+        with self.lock:
+            self.states[e_id] = 'disable'
+
+    def insert(self, i_ck):  # 方法 新增变量 同一 pin 只保留最后一个
+        searchObj = pin_re.search(i_ck)  # 正则检索 pt_pin
+        with self.lock:
+            self.inserts[searchObj.group(1) if searchObj else i_ck] = i_ck
+
+    def tick(self):  # 方法 每处理完一个账号调用 返回是否满 size 个需要提交
+        with self.lock:
+            self.count += 1
+            return self.size > 0 and self.count % self.size == 0
 
+    def flush(self):  # 方法 提交缓冲 返回 {变量id/pin: bool}
+        with self.flush_lock:  # 串行提交
+            with self.lock:  # 取出缓冲
+                updates, self.updates = self.updates, {}
+                states, self.states = self.states, {}
+                inserts, self.inserts = self.inserts, {}
+            results = {}  # 逐个结果
+            for e_id, n_ck in updates.items():  # 青龙无批量更新接口 逐个 PUT
+                results[e_id] = self.client.update(e_id, n_ck)
+                if not results[e_id]:  # 更新失败不再启用
+                    states.pop(e_id, None)
+            for action in ('enable', 'disable'):  # 批量启用 / 禁用
+                ids = [e_id for e_id, act in states.items() if act == action]  # 本批 id
+                if not ids:  # 无操作
+                    continue  # 继续循环
+                if self.client.state(action, ids):  # 一次请求提交整批
+                    ok = {e_id: True for e_id in ids}
+                else:  # 整批失败 逐个提交 以得到逐个结果
+                    ok = {e_id: self.client.state(action, [e_id]) for e_id in ids}
+                for e_id in ids:  # 合并结果
+                    results[e_id] = results.get(e_id, True) and ok[e_id]
+                self.report('启用' if action == 'enable' else '禁用', ok)  # 输出结果
+            if inserts:  # 批量新增
+                created = {}  # 新增成功的 pin -> id
+                for env in self.client.insert(list(inserts.values())):
+                    searchObj = pin_re.search(env.get('value', ''))
+                    if searchObj:
+                        created[searchObj.group(1)] = env[self.client.ql_id]
+                ok = {pin: pin in created for pin in inserts}  # 逐个结果
+                results.update(ok)
+                self.report('添加', ok)  # 输出结果
+            return results  # 返回结果
+
+    def report(self, name, ok):  # 方法 输出批量结果
+        done = [str(k) for k, v in ok.items() if v]  # 成功列表
+        fail = [str(k) for k, v in ok.items() if not v]  # 失败列表
+        if done:
+            logger.info(self.client.label + "账号{0}完成 {1} 个: {2}".format(name, len(done), ', '.join(done)))  # 标准日志输出
+        if fail:
+            logger.info(self.client.label + "账号{0}失败 {1} 个: {2}".format(name, len(fail), ', '.join(fail)))  # 标准日志输出
+        logger.info("--------------------\n")  # 标准日志输出
 
-def ql_insert(i_ck):  # 方法 插入新变量
-    data = [{"value": i_ck, "name": "JD_COOKIE"}]  # POST数据载荷组合
-    data = json.dumps(data)  # Json格式化数据
-    url = ql_url + 'api/envs'
-    s.post(url=url, data=data)  # HTTP[POST]请求 使用session
-    logger.info("\n账号添加完成\n--------------------\n")  # 标准日志输出
 
+class QinglongClient:  # 类 青龙面板 登录 / JD_COOKIE 索引 / 批量回写 每个面板一个实例 可在多个线程间共用
+    def __init__(self, url, auth=None, pool=http_pool, cache=cache):
+        self.url = url  # 面板地址 以 / 结尾
+        self.auth = auth  # auth.json 路径 或 {username, password, twoFactorSecret} None 为本机默认路径
+        self.name = urlparse(url).netloc  # 面板名称
+        self.label = ''  # 多面板时日志前缀
+        self.pool = pool  # 连接池 默认为全局连接池
+        self.cache = cache  # 本地缓存 Token
+        self.session = pool.session(url)  # 青龙 Session 与登录请求共用连接池
+        self.session.headers.update({"Content-Type": "application/json;charset=UTF-8"})  # 增加 HTTP头 json 类型
+        self.ql_id = 'id'  # 变量 id 键名 老版本为 _id
+        self.index = EnvIndex()  # JD_COOKIE 索引
+        self.writeback = WriteBack(self, 0)  # 回写缓冲 主函数中设置批量大小
+        self.online = True  # 本轮是否可用
+        self.lock = threading.Lock()  # 登录锁 多个线程同时遇到 Token 失效时只登录一次
 
-def cloud_info():  # 方法 云端信息
-    url = str(base64.b64decode(url_t).decode()) + 'api/check_api'  # 设置 URL地址 路由 [check_api]
-    for i in range(3):  # For循环 3次
+    def two_factor_login(self, username, password, twoCode):  # 方法 青龙两步验证登录 返回 token 或 None
+        url = self.url + 'api/user/two-factor/login'
+        data = json.dumps({
+            "username": username,
+            "password": password,
+            "code": twoCode
+        })
+        res = http_request('PUT', url=url, headers=ql_headers(), data=data, pool=self.pool)
+        if res.status_code == 200 and res.json()["code"] == 200:
+            return res.json()["data"]['token']  # 从 res.text 返回值中 取出 Token值
+        return None  # 返回 None
+
+    def legacy_login(self, username, password):  # 方法 旧版青龙登录接口 返回 token 或 None
+        url = self.url + 'api/login'  # 设置青龙地址
+        payload = {
+            'username': username,
+            'password': password
+        }  # HTTP请求载荷
+        payload = json.dumps(payload)  # json格式化载荷
         try:  # 异常捕捉
-            headers = {"authorization": "Bearer Shizuku"}  # 设置 HTTP头
-            res = requests.get(url=url, verify=False, headers=headers, timeout=20).text  # HTTP[GET] 请求 超时 20秒
-        except requests.exceptions.ConnectTimeout:  # 异常捕捉
-            logger.info("\n获取云端参数超时, 正在重试!" + str(i))  # 标准日志输出
-            time.sleep(1)  # 休眠 1秒
-            continue  # 循环继续
-        except requests.exceptions.ReadTimeout:  # 异常捕捉
-            logger.info("\n获取云端参数超时, 正在重试!" + str(i))  # 标准日志输出
-            time.sleep(1)  # 休眠 1秒
-            continue  # 循环继续
+            res = http_request('POST', url=url, headers=ql_headers(), data=payload, pool=self.pool)  # 使用 requests模块进行 HTTP POST请求
+            return json.loads(res.text)["data"]['token']  # 从 res.text 返回值中 取出 Token值
         except Exception as err:  # 异常捕捉
-            logger.info("\n未知错误云端, 退出脚本!")  # 标准日志输出
-            logger.debug(str(err))  # 调试日志输出
-            sys.exit(1)  # 脚本退出
-        else:  # 分支判断
+            logger.debug(str(err))  # Debug日志输出
+            return None  # 返回 None
+
+    # 登录青龙 返回值 token, 登录方式 (new / 2fa / legacy)
+    def get_token(self, username, password, twoFactorSecret, flavor=''):  # 方法 用于获取青龙 Token flavor 为上次成功的登录方式
+        logger.info(self.label + "Token失效, 新登陆\n")  # 日志输出
+        if flavor == 'legacy':  # 上次使用旧版接口 直接使用
+            token = self.legacy_login(username, password)
+            if token:
+                return token, 'legacy'
+        if twoFactorSecret:
+            try:
+                twoCode = ttotp(twoFactorSecret)
+            except Exception as err:
+                logger.debug(str(err))  # Debug日志输出
+                logger.info("TOTP异常")
+                raise WskeyError('TOTP异常')  # 中止 脚本入口转为退出码
+            if flavor == '2fa':  # 上次需要两步验证 直接提交验证码
+                try:  # 异常捕捉
+                    token = self.two_factor_login(username, password, twoCode)
+                except Exception as err:
+                    logger.debug(str(err))  # Debug日志输出
+                    token = None
+                if token:
+                    return token, '2fa'
+            url = self.url + "api/user/login"  # 设置青龙地址
+            payload = json.dumps({
+                'username': username,
+                'password': password
+            })  # HTTP请求载荷
             try:  # 异常捕捉
-                c_info = json.loads(res)  # json读取参数
-            except Exception as err:  # 异常捕捉
-                logger.info("云端参数解析失败")  # 标准日志输出
-                logger.debug(str(err))  # 调试日志输出
-                sys.exit(1)  # 脚本退出
-            else:  # 分支判断
-                return c_info  # 返回 -> c_info
+                res = http_request('POST', url=url, headers=ql_headers(), data=payload, pool=self.pool)  # 使用 requests模块进行 HTTP POST请求
+                if res.status_code == 200 and res.json()["code"] == 420:
+                    token = self.two_factor_login(username, password, twoCode)
+                    if token:
+                        return token, '2fa'
+                    else:
+                        logger.info(self.label + "两步校验失败\n")  # 日志输出
+                        raise WskeyError(self.label + '两步校验失败')  # 中止 脚本入口转为退出码
+                elif res.status_code == 200 and res.json()["code"] == 200:
+                    token = res.json()["data"]['token']  # 从 res.text 返回值中 取出 Token值
+                    return token, 'new'
+                else:  # 密码错误等
+                    ql_send(self.label + "青龙登录失败!")
+                    raise WskeyError(self.label + '青龙登录失败')  # 中止 脚本入口转为退出码
+            except WskeyError:  # 两步校验失败/登录失败 直接中止
+                raise
+            except Exception as err:
+                logger.debug(str(err))  # Debug日志输出
+                raise WskeyError(self.label + '青龙登录失败')  # 中止 脚本入口转为退出码
+        else:
+            url = self.url + 'api/user/login'
+            payload = {
+                'username': username,
+                'password': password
+            }  # HTTP请求载荷
+            payload = json.dumps(payload)  # json格式化载荷
+            try:  # 异常捕捉
+                res = http_request('POST', url=url, headers=ql_headers(), data=payload, pool=self.pool)  # 使用 requests模块进行 HTTP POST请求
+                if res.status_code == 200 and res.json()["code"] == 200:
+                    token = res.json()["data"]['token']  # 从 res.text 返回值中 取出 Token值
+                    return token, 'new'
+                else:
+                    ql_send(self.label + "青龙登录失败!")
+                    raise WskeyError(self.label + '青龙登录失败')  # 中止 脚本入口转为退出码
+            except WskeyError:  # 登录失败 不再尝试旧版接口
+                raise
+            except Exception as err:
+                logger.debug(str(err))  # Debug日志输出
+                logger.info("使用旧版青龙登录接口")
+                token = self.legacy_login(username, password)
+                if token is None:  # 登录失败
+                    logger.info(self.label + "青龙登录失败, 请检查面板状态!")  # 标准日志输出
+                    ql_send(self.label + '青龙登陆失败, 请检查面板状态.')
+                    raise WskeyError(self.label + '青龙登录失败')  # 中止 脚本入口转为退出码
+                else:  # 无异常执行分支
+                    return token, 'legacy'  # 返回 token值
 
+    def read_auth(self):  # 方法 读取登录账号 返回 dict 或 None
+        if isinstance(self.auth, dict):  # WSKEY_PANELS 中直接配置的账号
+            return dict(self.auth)
+        path = self.auth or os.environ.get("WSKEY_AUTH_FILE") or '/ql/config/auth.json'  # 设置青龙 auth文件地址
+        if not self.auth and not os.path.isfile(path):
+            path = '/ql/data/config/auth.json'  # 尝试设置青龙 auth 新版文件地址
+        if os.path.isfile(path):  # 进行文件真值判断
+            with open(path, "r") as file:  # 上下文管理
+                auth = file.read()  # 读取文件
+            return json.loads(auth)  # 使用 json模块读取
+        if cassette.auth:  # 回放时可使用录制的账号
+            return dict(cassette.auth)
+        return None  # 返回 None
 
-def check_cloud():  # 方法 云端地址检查
-    url_list = ['aHR0cHM6Ly9hcGkubW9tb2UubWwv', 'aHR0cHM6Ly9hcGkubGltb2UuZXUub3JnLw==', 'aHR0cHM6Ly9hcGkuaWxpeWEuY2Yv']  # URL list Encode
-    for i in url_list:  # for循环 url_list
-        url = str(base64.b64decode(i).decode())  # 设置 url地址 [str]
+    # 返回值 Token
+    @timed('ql_login')
+    def login(self):  # 方法 青龙登录(获取Token 功能同上) 优先使用未过期的缓存 Token
+        cached = self.cache.get('ql_token@' + self.url, float('inf')) or {}  # 上次验证通过的 Token 按面板缓存
+        if cached.get('exp', 0) - time.time() > 600:  # 距过期超过 10 分钟
+            logger.info(self.label + "使用缓存 Token\n")  # 标准日志输出
+            return cached['token']  # 跳过验证请求
+        auth = self.read_auth()  # 登录账号
+        if auth is None:  # 判断分支
+            logger.info(self.label + "没有发现auth文件, 你这是青龙吗???")  # 输出标准日志
+            raise WskeyError(self.label + '没有发现auth文件', 0)  # 中止 脚本入口转为退出码
+        if cassette.mode == 'record':  # 录制账号 (已替换)
+            cassette.auth = cassette.scrub_json(auth)
+        username = auth["username"]  # 提取 username
+        password = auth["password"]  # 提取 password
+        token = auth.get("token", '')  # 提取 authkey
+        flavor = cached.get('flavor', '')  # 上次成功的登录方式
+        twoFactorSecret = auth.get("twoFactorSecret") or ''
+        if token == '':  # 判断 Token是否为空
+            token, flavor = self.get_token(username, password, twoFactorSecret, flavor)  # 调用方法 get_token 传递 username & password
+        else:  # 判断分支
+            url = self.url + 'api/user'  # 设置URL请求地址
+            headers = {
+                'Authorization': 'Bearer {0}'.format(token),
+                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/94.0.4606.71 Safari/537.36 Edg/94.0.992.38'
+            }  # 设置用于 HTTP头
+            res = http_request('GET', url=url, headers=headers, pool=self.pool)  # 调用 request模块发送 get请求
+            if res.status_code != 200:  # 判断 HTTP返回状态码 无效时重新登录
+                token, flavor = self.get_token(username, password, twoFactorSecret, flavor)  # 调用方法 get_token 传递 username & password
+        self.cache.set('ql_token@' + self.url, {'token': token, 'exp': jwt_exp(token), 'flavor': flavor})  # 缓存 Token
+        return token  # 返回 token
+
+    def authorize(self):  # 方法 登录并设置 Session 认证头
+        with self.lock:  # 加锁 其他线程等待后直接使用缓存 Token
+            self.session.headers.update({"authorization": "Bearer " + str(self.login())})  # 增加 HTTP头认证
+
+    @timed('get_env')
+    def get_env(self, retry=True):  # 方法 读取 JD_COOKIE 变量 服务端过滤 流式解析 只保留需要的字段
+        url = self.url + 'api/envs'
+        keep = ('name', 'value', 'id', '_id', 'status')  # 保留字段
+        try:  # 异常捕捉
+            res = self.session.get(url, params={'searchValue': 'JD_COOKIE'}, stream=True)  # HTTP请求 [GET] 使用 session 新版青龙按名称过滤
+            if res.status_code == 401 and retry:  # 缓存 Token 已被面板作废
+                res.close()  # 释放连接
+                self.cache.drop('ql_token@' + self.url)  # 删除缓存 Token
+                self.authorize()  # 重新登录
+                return self.get_env(False)  # 重试一次
+            data = []  # 变量列表
+            stream = JsonStream(res)  # 流式解析
+            for env in stream.items('data'):  # 逐个解析 旧版青龙忽略过滤参数时在本地过滤
+                if isinstance(env, dict) and env.get('name') == 'JD_COOKIE':  # 只保留 JD_COOKIE
+                    data.append({k: env[k] for k in keep if k in env})  # 精简字段
+            res.close()  # 释放连接
+            if res.status_code != 200 or stream.fields.get('code') != 200 or not stream.found:  # 接口报错 不能当作没有变量 否则会重复新增
+                raise ValueError("HTTP {0} code {1} {2}".format(res.status_code, stream.fields.get('code'), stream.fields.get('message', '')))
+        except Exception as err:  # 异常捕捉
+            logger.debug(str(err))  # 调试日志输出
+            logger.info("\n" + self.label + "青龙环境接口错误")  # 标准日志输出
+            raise WskeyError(self.label + '青龙环境接口错误')  # 中止 脚本入口转为退出码
+        else:  # 判断分支
+            return data  # 返回 -> data
+
+    def check_id(self, envs):  # 方法 兼容青龙老版本与新版本 id & _id的问题 使用 get_env 的结果判断
+        if envs and '_id' in envs[0]:  # 判断 [_id]
+            logger.info(self.label + "使用 _id 键值")  # 标准日志输出
+            return '_id'  # 返回 -> '_id'
+        else:  # 判断分支
+            logger.info(self.label + "使用 id 键值")  # 标准日志输出
+            return 'id'  # 返回 -> 'id'
+
+    def load(self):  # 方法 读取变量 判断 id 键名 建立 pt_pin 索引
+        envlist = self.get_env()  # 调用方法 [get_env] 并赋值 [envlist]
+        self.ql_id = self.check_id(envlist)  # 调用方法 [check_id] 并赋值 [ql_id]
+        self.index.load(envlist, self.ql_id)  # 建立 pt_pin 索引
+
+    @timed('ql_update')
+    def update(self, e_id, n_ck):  # 方法 青龙更新变量 传递 id cookie 启用由回写缓冲批量提交
+        url = self.url + 'api/envs'
+        data = {
+            "name": "JD_COOKIE",
+            "value": n_ck,
+            self.ql_id: e_id
+        }  # 设置 HTTP POST 载荷
+        data = json.dumps(data)  # json模块格式化
+        try:  # 异常捕捉
+            res = json.loads(self.session.put(url=url, data=data).text)  # HTTP [PUT] 请求 使用 session
+        except Exception as err:  # 异常捕捉
+            logger.debug(str(err))  # 调试日志输出
+            return False  # 返回 -> False
+        if res['code'] == 200:  # 判断返回值为 200
+            self.index.put(e_id, n_ck)  # 同步索引
+            return True  # 返回 -> True
+        return False  # 返回 -> False
+
+    @timed('ql_state')
+    def state(self, action, ids):  # 方法 青龙变量批量启用/禁用 action: enable / disable
+        url = self.url + 'api/envs/' + action
+        data = json.dumps([str(e_id) for e_id in ids])  # 格式化 PUT 载荷 [数组]
+        try:  # 异常捕捉
+            res = json.loads(self.session.put(url=url, data=data).text)  # json模块读取 HTTP[PUT] 的返回值
+        except Exception as err:  # 异常捕捉
+            logger.debug(str(err))  # 调试日志输出
+            return False  # 返回 -> False
+        if res['code'] == 200:  # 判断返回值为 200
+            for e_id in ids:  # 同步索引状态
+                self.index.set_status(e_id, 0 if action == 'enable' else 1)
+            return True  # 返回 -> True
+        return False  # 返回 -> False
+
+    @timed('ql_insert')
+    def insert(self, cks):  # 方法 批量插入新变量 返回青龙新建的变量列表
+        data = [{"value": i_ck, "name": "JD_COOKIE"} for i_ck in cks]  # POST数据载荷组合
+        data = json.dumps(data)  # Json格式化数据
+        url = self.url + 'api/envs'
         try:  # 异常捕捉
-            requests.get(url=url, verify=False, timeout=10)  # HTTP[GET]请求 超时 10秒
+            res = self.session.post(url=url, data=data).json()  # HTTP[POST]请求 使用session
+            envs = res['data'] if res['code'] == 200 else []  # 青龙返回新建的变量
         except Exception as err:  # 异常捕捉
             logger.debug(str(err))  # 调试日志输出
-            continue  # 循环继续
-        else:  # 分支判断
-            info = ['HTTPS', 'Eu_HTTPS', 'CloudFlare']  # 输出信息[List]
-            logger.info(str(info[url_list.index(i)]) + " Server Check OK\n--------------------\n")  # 标准日志输出
-            return i  # 返回 ->i
+            return []  # 返回 -> 空列表
+        for env in envs:  # 同步索引
+            self.index.put(env[self.ql_id], env['value'], env.get('status', 0))
+        return envs  # 返回 -> 新建变量
+
+
+def load_panels(text):  # 方法 解析 WSKEY_PANELS 面板以换行/空格/& 分隔 第一个为主面板 每项格式: 地址[|auth.json 路径] 或 地址|用户名|密码[|2FA 密钥] 为空时使用 WSKEY_QL_URL 或本机面板
+    if not text:  # 单面板
+        if os.environ.get("WSKEY_QL_URL"):  # 指定青龙地址 (测试/远程面板) 跳过端口检查
+            return [QinglongClient(base_url("WSKEY_QL_URL", ''))]
+        port = check_port()  # 调用方法 [check_port]  并赋值 [port]
+        return [QinglongClient('http://127.0.0.1:{0}/'.format(port))]
+    result = []  # 面板列表
+    for item in re.split(r'[\s&]+', text or ''):  # 遍历面板
+        if not item:  # 空项
+            continue
+        parts = item.split('|')  # 地址与账号
+        if len(parts) >= 3:  # 直接配置账号
+            auth = {'username': parts[1], 'password': parts[2], 'token': '', 'twoFactorSecret': parts[3] if len(parts) > 3 else ''}
+        else:  # auth.json 路径 省略时使用默认路径
+            auth = parts[1] if len(parts) == 2 and parts[1] else None
+        result.append(QinglongClient(parts[0].rstrip('/') + '/', auth))
+    if len(result) > 1:  # 多面板 日志中标明面板
+        for panel in result:
+            panel.label = '[{0}] '.format(panel.name)
+    return result  # 返回面板
+
+
+def each_panel(func, targets=None):  # 方法 在各面板上并发执行 func(panel) 主面板失败时退出 其他面板失败时本轮跳过该面板
+    targets = [panel for panel in panels if panel.online] if targets is None else targets  # 默认只处理本轮可用的面板
+
+    def call(panel):
+        try:  # 异常捕捉 登录/接口错误时抛出 WskeyError
+            func(panel)
+            return True
+        except Exception as err:
+            if panel is panels[0]:  # 主面板失败 与单面板时相同
+                raise
+            logger.debug(str(err))  # 调试日志输出
+            logger.info("青龙面板 {0} 不可用, 本轮跳过\n".format(panel.name))  # 标准日志输出
+            return False
+
+    if len(targets) == 1:  # 单面板 不启用线程池
+        results = [call(targets[0])]
+    else:  # 多面板并发
+        with ThreadPoolExecutor(max_workers=len(targets)) as pool:
+            results = list(pool.map(call, targets))
+    for panel, ok in zip(targets, results):  # 记录可用状态
+        panel.online = ok
+
+
+def fan_out(pin, ck):  # 方法 把 Cookie 同步到各面板 没有该账号时新增 值不同时更新并启用 相同时启用
+    for panel in panels:  # 遍历面板
+        if not panel.online:  # 本轮不可用
+            continue
+        env = panel.index.get(pin)  # 该面板已有的 JD_COOKIE
+        if env is None:  # 新账号
+            panel.writeback.insert(ck)  # 回写缓冲 新增
+        elif env['value'] != ck:  # 值不同
+            panel.writeback.update(env['id'], ck)  # 回写缓冲 更新并启用
+        else:  # 值相同
+            panel.writeback.enable(env['id'])  # 回写缓冲 启用
+
+
+def disable_all(pin):  # 方法 在各面板禁用该账号
+    for panel in panels:  # 遍历面板
+        env = panel.index.get(pin) if panel.online else None  # 该面板已有的 JD_COOKIE
+        if env:
+            panel.writeback.disable(env['id'])  # 回写缓冲 禁用
+
+
+def flush_panels():  # 方法 并发提交各面板的回写缓冲
+    each_panel(lambda panel: panel.writeback.flush())
+
+
+def tick_panels():  # 方法 每处理完一个账号调用 满批量大小时提交
+    if panels[0].writeback.tick():  # 各面板批量大小相同 由主面板计数
+        flush_panels()
+
+
+def panels_synced(pin, value):  # 方法 其他可用面板是否已有相同的 Cookie
+    for panel in panels[1:]:  # 遍历其他面板
+        env = panel.index.get(pin) if panel.online else None  # 该面板已有的 JD_COOKIE
+        if panel.online and (env is None or env['value'] != value):  # 未同步
+            return False
+    return True
+
+
+def mirror_record(i, latency, store):  # 方法 记录云端地址探测结果到本地缓存 store latency 为 None 表示失败
+    with mirror_lock:  # 加锁 多个探测线程同时写入
+        history = store.get('mirrors', float('inf')) or {}  # 读取历史
+        item = history.setdefault(i, {'latency': None, 'fails': 0, 'last_fail': 0})  # 地址记录
+        if latency is None:  # 探测失败
+            item['fails'] += 1  # 连续失败次数
+            item['last_fail'] = time.time()  # 最近失败时间
+        else:  # 探测成功
+            item['fails'] = 0  # 清零
+            old = item['latency']  # 历史延迟
+            item['latency'] = latency if old is None else old * 0.7 + latency * 0.3  # 指数加权平均
+        store.set('mirrors', history)  # 写入缓存
+
+
+def mirror_rank(url_list, store):  # 方法 按本地缓存 store 中的历史延迟排序云端地址 跳过近期连续失败的地址
+    history = store.get('mirrors', float('inf')) or {}  # 读取历史
+    now = time.time()  # 当前时间
+
+    def healthy(i):  # 连续失败 3 次的地址冷却 30 分钟
+        item = history.get(i)
+        return not item or item['fails'] < 3 or now - item['last_fail'] > 1800
+
+    def latency(i):  # 未知延迟排在已知延迟之后 保持原顺序
+        item = history.get(i)
+        return item['latency'] if item and item['latency'] is not None else float('inf')
+
+    order = [i for i in url_list if healthy(i)] or list(url_list)  # 全部失效时仍全部探测
+    return sorted(order, key=lambda i: (latency(i), url_list.index(i))), latency
+
+
+def mirror_probe(i, pool, store):  # 方法 经连接池 pool 探测单个云端地址 结果记录到 store 返回 bool
+    url = str(base64.b64decode(i).decode())  # 设置 url地址 [str]
+    start = time.time()  # 开始时间
+    try:  # 异常捕捉
+        http_request('GET', url=url, verify=False, timeout=10, pool=pool)  # HTTP[GET]请求 超时 10秒
+    except Exception as err:  # 异常捕捉
+        logger.debug(str(err))  # 调试日志输出
+        mirror_record(i, None, store)  # 记录失败
+        return False  # 返回 -> False
+    mirror_record(i, time.time() - start, store)  # 记录延迟
+    logger.debug("{0} 延迟 {1:.3f} 秒".format(url, time.time() - start))  # 调试日志输出
+    return True  # 返回 -> True
+
+
+@timed('check_cloud')
+def check_cloud(pool=None, store=None):  # 方法 云端地址检查 按历史延迟依次发起探测 先返回成功的地址胜出 pool / store 默认为全局连接池 / 本地缓存
+    pool = http_pool if pool is None else pool  # 连接池
+    store = cache if store is None else store  # 本地缓存
+    url_list = ['aHR0cHM6Ly9hcGkubW9tb2UubWwv', 'aHR0cHM6Ly9hcGkubGltb2UuZXUub3JnLw==', 'aHR0cHM6Ly9hcGkuaWxpeWEuY2Yv']  # URL list Encode
+    info = ['HTTPS', 'Eu_HTTPS', 'CloudFlare']  # 输出信息[List]
+    queue, latency = mirror_rank(url_list, store)  # 探测顺序
+    probes = ThreadPoolExecutor(max_workers=len(queue))  # 探测线程池
+    pending = {}  # future -> 地址
+    winner = None  # 胜出地址
+    try:  # 异常捕捉
+        while winner is None and (queue or pending):  # 未决出且仍有地址
+            if queue:  # 发起下一个探测
+                i = queue.pop(0)
+                pending[probes.submit(profiler.wrap(mirror_probe), i, pool, store)] = i
+                hedge = latency(i) * 2 if latency(i) != float('inf') else 0  # 已知延迟的地址先等待其两倍延迟
+                timeout = min(2.0, max(0.3, hedge)) if hedge else 0  # 未知延迟时同时探测
+            done, _ = wait(pending, timeout=timeout if queue else None, return_when=FIRST_COMPLETED)  # 等待任一完成
+            for future in done:  # 检查结果
+                i = pending.pop(future)
+                if future.result() and winner is None:  # 首个成功
+                    winner = i
+    finally:  # 无论成功与否
+        probes.shutdown(wait=False)  # 不等待较慢的探测
+    if winner is not None:  # 分支判断
+        logger.info(str(info[url_list.index(winner)]) + " Server Check OK\n--------------------\n")  # 标准日志输出
+        return winner  # 返回 ->i
     logger.info("\n云端地址全部失效, 请检查网络!")  # 标准日志输出
     ql_send('云端地址失效. 请联系作者或者检查网络.')  # 推送消息
-    sys.exit(1)  # 脚本退出
+    raise WskeyError('云端地址全部失效')  # 中止 脚本入口转为退出码
 
 
 def check_port():  # 方法 检查变量传递端口
@@ -555,85 +2059,367 @@ def check_port():  # 方法 检查变量传递端口
             return 5700  # 返回端口 5700
     else:  # 判断分支
         port = 5700  # 默认5700端口
-    if not ql_check(port):  # 调用方法 [ql_check] 传递 [port]
+    if cassette.mode != 'replay' and not ql_check(port):  # 调用方法 [ql_check] 传递 [port] 回放时无需青龙
         logger.info(str(port) + "端口检查失败, 如果改过端口, 请在变量中声明端口 \n在config.sh中加入 export QL_PORT=\"端口号\"")  # 标准日志输出
         logger.info("\n如果你很确定端口没错, 还是无法执行, 在GitHub给我发issus\n--------------------\n")  # 标准日志输出
-        sys.exit(1)  # 脚本退出
+        raise WskeyError('{0}端口检查失败'.format(port))  # 中止 脚本入口转为退出码
     else:  # 判断分支
         logger.info(str(port) + "端口检查通过")  # 标准日志输出
         return port  # 返回->port
 
 
-if __name__ == '__main__':  # Python主函数执行入口
-    port = check_port()  # 调用方法 [check_port]  并赋值 [port]
-    ql_url = 'http://127.0.0.1:{0}/'.format(port)
-    token = ql_login()  # 调用方法 [ql_login]  并赋值 [token]
-    s = requests.session()  # 设置 request session方法
-    s.headers.update({"authorization": "Bearer " + str(token)})  # 增加 HTTP头认证
-    s.headers.update({"Content-Type": "application/json;charset=UTF-8"})  # 增加 HTTP头 json 类型
-    ql_id = check_id()  # 调用方法 [check_id] 并赋值 [ql_id]
-    url_t = check_cloud()  # 调用方法 [check_cloud] 并赋值 [url_t]
-    cloud_arg = cloud_info()  # 调用方法 [cloud_info] 并赋值 [cloud_arg]
-    update()  # 调用方法 [update]
-    ua = cloud_arg['User-Agent']  # 设置全局变量 UA
-    wslist = get_wskey()  # 调用方法 [get_wskey] 并赋值 [wslist]
-    envlist = get_env()  # 调用方法 [get_env] 并赋值 [envlist]
-    if "WSKEY_SLEEP" in os.environ and str(os.environ["WSKEY_SLEEP"]).isdigit():  # 判断变量[WSKEY_SLEEP]是否为数字类型
-        sleepTime = int(os.environ["WSKEY_SLEEP"])  # 获取变量 [int]
-    else:  # 判断分支
-        sleepTime = 10  # 默认休眠时间 10秒
-    for ws in wslist:  # wslist变量 for循环  [wslist -> ws]
-        wspin = ws.split(";")[0]  # 变量分割 ;
-        if "pin" in wspin:  # 判断 pin 是否存在于 [wspin]
-            wspin = "pt_" + wspin + ";"  # 封闭变量
-            return_serch = serch_ck(wspin)  # 变量 pt_pin 搜索获取 key eid
-            if return_serch[0]:  # bool: True 搜索到账号
-                jck = str(return_serch[1])  # 拿到 JD_COOKIE
-                if not check_ck(jck):  # bool: False 判定 JD_COOKIE 有效性
-                    tryCount = 1  # 重试次数 1次
-                    if "WSKEY_TRY_COUNT" in os.environ:  # 判断 [WSKEY_TRY_COUNT] 是否存在于系统变量
-                        if os.environ["WSKEY_TRY_COUNT"].isdigit():  # 判断 [WSKEY_TRY_COUNT] 是否为数字
-                            tryCount = int(os.environ["WSKEY_TRY_COUNT"])  # 设置 [tryCount] int
-                    for count in range(tryCount):  # for循环 [tryCount]
-                        count += 1  # 自增
-                        return_ws = getToken(ws)  # 使用 WSKEY 请求获取 JD_COOKIE bool jd_ck
-                        if return_ws[0]:  # 判断 [return_ws]返回值 Bool类型
-                            break  # 中断循环
-                        if count < tryCount:  # 判断循环次
-                            logger.info("{0} 秒后重试，剩余次数：{1}\n".format(sleepTime, tryCount - count))  # 标准日志输出
-                            time.sleep(sleepTime)  # 脚本休眠 使用变量 [sleepTime]
-                    if return_ws[0]:  # 判断 [return_ws]返回值 Bool类型
-                        nt_key = str(return_ws[1])  # 从 return_ws[1] 取出 -> nt_key
-                        # logger.info("wskey转pt_key成功", nt_key)  # 标准日志输出 [未启用]
-                        logger.info("wskey转换成功")  # 标准日志输出
-                        eid = return_serch[2]  # 从 return_serch 拿到 eid
-                        ql_update(eid, nt_key)  # 函数 ql_update 参数 eid JD_COOKIE
-                    else:  # 判断分支
-                        if "WSKEY_AUTO_DISABLE" in os.environ:  # 从系统变量中获取 WSKEY_AUTO_DISABLE
-                            logger.info(str(wspin) + "账号失效")  # 标准日志输出
-                            text = "账号: {0} WsKey疑似失效".format(wspin)  # 设置推送内容
-                        else:  # 判断分支
-                            eid = return_serch[2]  # 读取 return_serch[2] -> eid
-                            logger.info(str(wspin) + "账号禁用")  # 标准日志输出
-                            ql_disable(eid)  # 执行方法[ql_disable] 传递 eid
-                            text = "账号: {0} WsKey疑似失效, 已禁用Cookie".format(wspin)  # 设置推送内容
-                            ql_send(text)
-                else:  # 判断分支
-                    logger.info(str(wspin) + "账号有效")  # 标准日志输出
-                    eid = return_serch[2]  # 读取 return_serch[2] -> eid
-                    ql_enable(eid)  # 执行方法[ql_enable] 传递 eid
-                    logger.info("--------------------\n")  # 标准日志输出
+def base_url(name, default):  # 方法 读取接口地址变量 统一以 / 结尾
+    return (os.environ.get(name) or default).rstrip('/') + '/'
+
+
+def ws_pin(ws):  # 方法 从 wskey 首段取出 pin 格式错误返回 None
+    searchObj = ws_pin_re.search(ws)  # 预编译正则
+    return searchObj.group(1) if searchObj else None  # 返回 pin
+
+
+def ck_fp(ck):  # 方法 Cookie 指纹 用于判断缓存结果是否仍对应同一个 Cookie
+    return hashlib.sha1(ck.encode()).hexdigest()[:16]  # 返回指纹
+
+
+@timed('precheck')
+def precheck(accounts, workers):  # 方法 转换前并发检查全部已有 JD_COOKIE 结果写入 account.valid 返回检查的账号数
+    if "WSKEY_DISCHECK" in os.environ:  # 不检查有效性
+        return 0  # 返回 -> 0
+    by_hour = "WSKEY_UPDATE_HOUR" in os.environ  # 按时间判断时无需记录
+    todo = [account for account in accounts if account.ck is not None]  # 新账号无需检查
+
+    def check(account):  # 时间预算用尽后不再检查 返回 None
+        return None if over_budget() else converter.check(account)
+
+    if todo:  # 并发检查
+        logger.info("预检查 {0} 个账号, 线程数: {1}\n".format(len(todo), workers))  # 标准日志输出
+        skipped = 0  # 因超时未检查的账号数
+        with ThreadPoolExecutor(max_workers=workers) as pool:  # 线程池
+            for account, ok in zip(todo, pool.map(profiler.wrap(check), todo)):  # 按顺序取结果
+                if ok is None:  # 未检查
+                    skipped += 1
+                    continue
+                account.valid = ok
+                if not by_hour:  # 记录结果 有效结果在 WSKEY_CHECK_TTL 内跳过该账号
+                    state.record_check(account.pin, ok, account.ck)
+        if skipped:  # 输出未检查数
+            logger.info("时间预算已用尽, {0} 个账号未预检查\n".format(skipped))  # 标准日志输出
+        return len(todo) - skipped  # 返回 -> 检查数
+    return 0  # 返回 -> 0
+
+
+def bind_accounts(accounts):  # 方法 关联主面板已有的 JD_COOKIE
+    index = panels[0].index  # 主面板索引
+    for account in accounts:
+        account.bind(index.get(account.pin) if account.pin else None)
+
+
+def changed_accounts(accounts):  # 方法 增量模式 只保留新增或变化的 wskey
+    result = []  # 需要处理
+    for account in accounts:  # 遍历账号
+        row = state.get(account.pin) if account.pin else None  # 账号状态
+        if account.pin and (not row or row['ws_fp'] != account.ws_fp):  # 新账号或 wskey 已更换
+            result.append(account)
+    return result  # 返回账号
+
+
+def due_accounts(accounts):  # 方法 过滤本次需要处理的账号
+    result, skipped = [], 0  # 需要处理 / 跳过数
+    for account in accounts:  # 遍历账号
+        if account.pin is None:  # 格式错误交给 process_ws 输出
+            result.append(account)
+            continue
+        due, reason = state.due(account.pin, account.ws_fp, account.ck or '')  # 是否到期
+        if due or account.ck and not panels_synced(account.pin, account.ck):  # 需要处理 其他面板缺少或不一致时同步
+            result.append(account)
+        else:  # 跳过
+            skipped += 1
+            logger.debug("{0} 跳过: {1}".format(account.pin, reason))  # 调试日志输出
+    if skipped:  # 输出跳过数
+        logger.info("跳过 {0} 个未到期账号, 本次处理 {1} 个\n".format(skipped, len(result)))  # 标准日志输出
+    return result  # 返回账号
+
+
+def ws_deadline(account):  # 方法 账号 Cookie 的到期时间戳 新账号/已失效/无法判断返回 0 (最先处理)
+    if account.ck is None or account.valid is False:  # 新账号或预检查失效
+        return 0.0
+    if "WSKEY_UPDATE_HOUR" not in os.environ:  # 未按时间更新 有效账号无到期时间
+        return float('inf')
+    updateHour = int(os.environ["WSKEY_UPDATE_HOUR"]) if os.environ["WSKEY_UPDATE_HOUR"].isdigit() else 23  # 更新间隔 与 check 一致
+    return account.updated + updateHour * 60 * 60 if account.updated is not None else 0.0  # 更新时间 + 更新间隔
+
+
+def run_deadline():  # 方法 本轮时间预算 (WSKEY_TIME_BUDGET 秒) 的截止时间戳 未设置返回 None
+    budget = env_num("WSKEY_TIME_BUDGET", 0, float)  # 时间预算
+    return run_start + budget if budget > 0 else None
+
+
+def over_budget(extra=0):  # 方法 再等待 extra 秒是否超出本轮时间预算
+    deadline = run_deadline()  # 截止时间
+    return deadline is not None and time.time() + extra >= deadline
+
+
+def schedule(accounts):  # 方法 按到期时间和失败次数建立账号队列 超出本轮时间预算后停止出队
+    items = []  # (账号, 到期时间, 失败次数)
+    for account in accounts:  # 遍历账号
+        row = state.get(account.pin) if account.pin else None  # 账号状态
+        items.append((account, ws_deadline(account), row['fail_count'] if row else 0))
+    return AccountQueue(items, run_deadline())  # 返回队列
+
+
+def process_ws(account):  # 方法 单个账号的完整转换流程
+    if account.pin is None:  # 格式错误
+        logger.info("WSKEY格式错误\n--------------------\n")  # 标准日志输出
+        return
+    wspin = account.label  # pt_pin=xxx;
+    if account.eid is not None:  # 主面板已有该账号
+        logger.info(wspin + "检索成功\n")  # 标准日志输出
+        valid = account.valid  # 预检查结果
+        if valid is None:  # 未预检查
+            valid = converter.check(account)  # 单独检查
+        if not valid:  # bool: False 判定 JD_COOKIE 有效性
+            tryCount = 1  # 重试次数 1次
+            if "WSKEY_TRY_COUNT" in os.environ:  # 判断 [WSKEY_TRY_COUNT] 是否存在于系统变量
+                if os.environ["WSKEY_TRY_COUNT"].isdigit():  # 判断 [WSKEY_TRY_COUNT] 是否为数字
+                    tryCount = int(os.environ["WSKEY_TRY_COUNT"])  # 设置 [tryCount] int
+            for count in range(tryCount):  # for循环 [tryCount]
+                count += 1  # 自增
+                nt_key = converter.convert(account)  # 使用 WSKEY 请求获取 JD_COOKIE 失败为 None
+                if nt_key or account.kind in ('fake', 'open'):  # 成功 / wskey 失效 / 熔断 无需重试
+                    break  # 中断循环
+                if count < tryCount:  # 判断循环次
+                    delay = jd_backoff.delay(count - 1)  # 指数退避
+                    if over_budget(delay):  # 等待后将超出时间预算 不再重试
+                        logger.info("时间预算不足, 不再重试\n")  # 标准日志输出
+                        break  # 中断循环
+                    logger.info("{0:.1f} 秒后重试，剩余次数：{1}\n".format(delay, tryCount - count))  # 标准日志输出
+                    time.sleep(delay)  # 脚本休眠
+            if account.kind == 'open':  # 熔断 不视为账号失效
+                logger.info(wspin + "JD接口熔断, 留待下次处理\n--------------------\n")  # 标准日志输出
+                return  # 返回
+            state.record_convert(account.pin, bool(nt_key), account.ws_fp, account.kind)  # 记录转换结果
+            if not nt_key and account.kind != 'fake':  # 风控/接口异常/云端参数失败 不视为账号失效 保留 Cookie
+                logger.info(wspin + "JD接口风控或异常, 留待下次处理\n--------------------\n")  # 标准日志输出
+                return  # 返回
+            if nt_key:  # 转换成功
+                state.record_check(account.pin, True, nt_key)  # 新 Cookie 视为有效
+                logger.info("wskey转换成功")  # 标准日志输出
+                fan_out(account.pin, nt_key)  # 回写缓冲 各面板更新并启用
+                notifier.tally('ok')  # 统计
             else:  # 判断分支
-                logger.info("\n新wskey\n")  # 标准日志分支
-                return_ws = getToken(ws)  # 使用 WSKEY 请求获取 JD_COOKIE bool jd_ck
-                if return_ws[0]:  # 判断 (return_ws[0]) 类型: [Bool]
-                    nt_key = str(return_ws[1])  # return_ws[1] -> nt_key
-                    logger.info("wskey转换成功\n")  # 标准日志输出
-                    ql_insert(nt_key)  # 调用方法 [ql_insert]
-            logger.info("暂停{0}秒\n".format(sleepTime))  # 标准日志输出
-            time.sleep(sleepTime)  # 脚本休眠
+                if "WSKEY_AUTO_DISABLE" in os.environ:  # 从系统变量中获取 WSKEY_AUTO_DISABLE
+                    logger.info(wspin + "账号失效")  # 标准日志输出
+                    text = "账号: {0} WsKey疑似失效".format(wspin)  # 设置推送内容
+                else:  # 判断分支
+                    logger.info(wspin + "账号禁用")  # 标准日志输出
+                    disable_all(account.pin)  # 回写缓冲 各面板禁用
+                    text = "账号: {0} WsKey疑似失效, 已禁用Cookie".format(wspin)  # 设置推送内容
+                    ql_send(text, account.pin)  # 摘要中列出失效账号
+                notifier.tally('fail')  # 统计
         else:  # 判断分支
-            logger.info("WSKEY格式错误\n--------------------\n")  # 标准日志输出
+            logger.info(wspin + "账号有效")  # 标准日志输出
+            fan_out(account.pin, account.ck)  # 回写缓冲 主面板启用 其他面板同步
+            state.record_seen(account.pin, account.ws_fp)  # 记录 wskey 指纹
+            notifier.tally('valid')  # 统计
+            logger.info("--------------------\n")  # 标准日志输出
+    else:  # 判断分支
+        logger.info(wspin + "检索失败\n")  # 标准日志输出
+        logger.info("\n新wskey\n")  # 标准日志分支
+        nt_key = converter.convert(account)  # 使用 WSKEY 请求获取 JD_COOKIE 失败为 None
+        if account.kind == 'open':  # 熔断 留待下次处理
+            logger.info(wspin + "JD接口熔断, 留待下次处理\n--------------------\n")  # 标准日志输出
+            return  # 返回
+        state.record_convert(account.pin, bool(nt_key), account.ws_fp, account.kind)  # 记录转换结果
+        if nt_key:  # 转换成功
+            state.record_check(account.pin, True, nt_key)  # 新 Cookie 视为有效
+            logger.info("wskey转换成功\n")  # 标准日志输出
+            fan_out(account.pin, nt_key)  # 回写缓冲 各面板新增
+            notifier.tally('new')  # 统计
+
+
+def process_serial(account):  # 方法 串行模式下执行单个账号
+    process_ws(account)  # 执行转换流程
+    tick_panels()  # 回写计数
+
+
+def process_buffered(account):  # 方法 并发模式下执行单个账号 日志整段输出
+    account_log.begin()  # 开始缓冲日志
+    try:  # 异常捕捉
+        process_ws(account)  # 执行转换流程
+        tick_panels()  # 回写计数
+    except Exception as err:  # 异常捕捉 单个账号异常不影响其他账号
+        logger.debug(str(err))  # 调试日志输出
+        logger.info("账号处理异常\n--------------------\n")  # 标准日志输出
+    finally:  # 无论成功与否
+        account_log.end()  # 输出缓冲日志
+
+
+def run_worker(queue, handle):  # 方法 工作线程 循环取出最紧急的账号执行
+    while True:  # 循环
+        account = queue.pop()  # 取账号
+        if account is None:  # 队列为空或时间预算用尽
+            return
+        handle(account)  # 执行账号
+
+
+def run_accounts(queue, workers):  # 方法 按并发数执行队列中的全部账号
+    if workers <= 1:  # 串行模式
+        run_worker(queue, process_serial)
+    else:  # 并发模式
+        logger.info("并发模式, 线程数: {0}\n".format(workers))  # 标准日志输出
+        logger.addFilter(account_log)  # 启用按账号缓冲日志
+        pool = ThreadPoolExecutor(max_workers=workers)  # 线程池
+        try:  # 异常捕捉
+            wait([pool.submit(profiler.wrap(run_worker), queue, process_buffered) for _ in range(workers)])  # 每个线程共享同一队列
+        except BaseException:  # 收到退出信号 (SIGTERM / Ctrl+C) 不再取出新账号
+            queue.stop()
+            raise
+        finally:  # 无论成功与否 等待进行中的账号完成
+            pool.shutdown(wait=True)
+            logger.removeFilter(account_log)  # 关闭缓冲
+    if queue.skipped:  # 输出因超时未处理的账号数
+        logger.info("时间预算已用尽, {0} 个账号留待下次运行\n".format(queue.skipped))  # 标准日志输出
+
+
+def refresh_session(cloud_ttl):  # 方法 刷新青龙 Token 与云端参数 缓存未过期时不发送请求
+    each_panel(QinglongClient.authorize, panels)  # 并发登录各面板 上一轮不可用的面板重新尝试
+    converter.refresh(cloud_ttl)  # 云端地址与参数
+
+
+def run_cycle(workers, changed_only=False):  # 方法 执行一轮转换 读取账号与变量 -> 预检查 -> 转换 -> 回写 changed_only 只处理新增/变化的 wskey
+    global run_start
+    run_start = time.time()  # 时间预算按轮计算
+    accounts = [Account(ws) for ws in get_wskey()]  # 每个账号解析一次 之后各步骤共用
+    if changed_only:  # 增量模式
+        accounts = changed_accounts(accounts)
+        if not accounts:  # 无变化
+            logger.info("没有新增或变化的 wskey\n")  # 标准日志输出
+            return
+        logger.info("检测到 {0} 个新增或变化的 wskey\n".format(len(accounts)))  # 标准日志输出
+    each_panel(QinglongClient.load)  # 并发读取各面板变量 建立 pt_pin 索引
+    bind_accounts(accounts)  # 关联主面板已有的 JD_COOKIE
+    if not changed_only:  # 变化的 wskey 无需判断是否到期
+        accounts = due_accounts(accounts)  # 只处理到期的账号
+    precheck(accounts, max(1, env_num("WSKEY_CHECK_WORKERS", max(8, workers))))  # 并发预检查
+    try:  # 异常捕捉
+        run_accounts(schedule(accounts), workers)  # 按到期时间执行账号 超出时间预算后停止
+    finally:  # 异常/退出信号时同样提交 已转换的 Cookie 不丢失
+        flush_panels()  # 并发提交各面板剩余回写
+    if workers > 1:  # 并发模式输出最终并发上限
+        logger.info("本次运行JD转换并发上限: {0}\n".format(int(limiter.limit)))  # 标准日志输出
+    proxy_pool.report()  # 输出代理统计
+    http_pool.report()  # 调试模式输出连接复用统计
+    if notifier.window <= 0:  # 每轮发送一次摘要
+        notifier.flush()
+
+
+def run_daemon(interval, workers, cloud_ttl):  # 方法 常驻模式 登录/云端参数/连接池只初始化一次 每 interval 秒或收到 SIGUSR1 时执行一轮 wskey 文件变化时增量执行
+    global live_env
+    live_env = True  # 每轮从 env.sh 读取 JD_WSCK
+    wake, stop, changed = threading.Event(), threading.Event(), threading.Event()  # 唤醒 / 退出 / 文件变化
+
+    def on_signal(signum, frame):  # 信号处理 只设置标记 不在信号中输出日志
+        if signum != getattr(signal, 'SIGUSR1', None):  # SIGTERM / SIGINT 本轮结束后退出
+            stop.set()
+        changed.clear()  # 完整执行已包含文件变化
+        wake.set()
+
+    for name in ('SIGUSR1', 'SIGTERM', 'SIGINT'):  # Windows 没有 SIGUSR1
+        if hasattr(signal, name):
+            signal.signal(getattr(signal, name), on_signal)
+    logger.info("常驻模式, 每 {0} 秒执行一轮, 发送 SIGUSR1 (kill -USR1 {1}) 立即执行\n".format(interval, os.getpid()))  # 标准日志输出
+    watched = [path for path in (env_file(), os.environ.get("WSKEY_FILE")) if path and path != '-']  # 监视的文件 标准输入无需监视
+    if watched and os.environ.get("WSKEY_WATCH") != 'disable':  # 文件变化时增量执行
+        FileWatch(watched, lambda: (changed.set(), wake.set()), env_num("WSKEY_WATCH_INTERVAL", 2.0, float)).start()
+        logger.info("监视 wskey 变化: {0}\n".format(', '.join(watched)))  # 标准日志输出
+    cycle, incremental = 0, False  # 轮次 / 本轮是否增量
+    while not stop.is_set():  # 循环执行
+        cycle += 1
+        logger.info("第 {0} 轮开始{1}\n--------------------\n".format(cycle, " (增量)" if incremental else ""))  # 标准日志输出
+        try:  # 异常捕捉 单轮失败不退出
+            if cycle > 1:  # 首轮已在启动时完成
+                refresh_session(cloud_ttl)  # Token 即将过期/云端参数过期时刷新
+            run_cycle(workers, incremental)  # 执行一轮
+        except WskeyError:  # 接口错误等导致的中止
+            logger.info("本轮执行中止, 等待下一轮\n")  # 标准日志输出
+        except Exception as err:  # 异常捕捉
+            logger.debug(str(err))  # 调试日志输出
+            logger.info("本轮执行异常, 等待下一轮\n")  # 标准日志输出
+        metrics.write(os.environ.get("WSKEY_PROM_FILE"), os.environ.get("WSKEY_SUMMARY_FILE"))  # 每轮写出统计
+        woken = stop.is_set() or wake.wait(interval)  # 等待下一轮
+        if stop.is_set():  # 收到退出信号
+            break
+        wake.clear()
+        incremental = woken and changed.is_set()  # 文件变化唤醒时只处理变化的 wskey 定时/SIGUSR1 为完整执行
+        changed.clear()
+    logger.info("常驻模式退出\n")  # 标准日志输出
+
+
+account_log = AccountLog()  # 全局账号日志缓冲
+panels = []  # 青龙面板 第一个为主面板 主函数中载入
+converter = WskeyConverter()  # 全局 wskey 转换
+run_start = time.time()  # 运行开始时间 时间预算由此计算
+live_env = False  # 常驻模式从 env.sh 读取最新 JD_WSCK
+stdin_wskeys = None  # WSKEY_FILE=- 时从标准输入读取的 wskey
+
+
+if __name__ == '__main__':  # Python主函数执行入口
+    os.environ['no_proxy'] = '*'  # 禁用代理 JD 出站代理由 WSKEY_PROXIES 指定
+    requests.packages.urllib3.disable_warnings()  # 抑制错误
+    if os.environ.get("WSKEY_PROFILE"):  # 性能分析模式
+        profiler.start(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'wskey.pstats') if os.environ["WSKEY_PROFILE"].lower() in ('1', 'true') else os.environ["WSKEY_PROFILE"])  # 默认与脚本同目录
+        atexit.register(profiler.stop)  # 退出时输出结果
+    workers = max(1, env_num("WSKEY_WORKERS", 1))  # 并发线程数 默认 1 (串行)
+    http_pool.size = max(1, env_num("WSKEY_POOL_SIZE", max(10, workers)))  # 每个主机的连接池大小
+    notifier.window = env_num("WSKEY_SEND_WINDOW", 0, float)  # 通知摘要时间窗口
+    atexit.register(notifier.close, env_num("WSKEY_SEND_TIMEOUT", 10, float))  # 退出前发送剩余通知 最多等待 10 秒
+    atexit.register(metrics.write, os.environ.get("WSKEY_PROM_FILE"), os.environ.get("WSKEY_SUMMARY_FILE"))  # 退出时写出统计 异常退出同样写出
+    if os.environ.get("WSKEY_REPLAY"):  # 回放模式 使用录制的响应
+        cassette.replay(os.environ["WSKEY_REPLAY"], max(0.0, env_num("WSKEY_REPLAY_SCALE", 1.0, float)))
+    elif os.environ.get("WSKEY_RECORD"):  # 录制模式
+        cassette.record(os.environ["WSKEY_RECORD"])
+    if os.environ.get("WSKEY_CACHE") != 'disable' and not cassette.mode:  # 未禁用本地缓存 录制/回放时仅内存 保证请求序列一致
+        cache.load(os.environ.get("WSKEY_CACHE") or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'wskey_cache.json'))  # 载入本地缓存 默认与脚本同目录
+    try:  # 异常捕捉 面板/云端/变量错误 (WskeyError) 转为退出码
+        panels = load_panels(os.environ.get("WSKEY_PANELS"))  # 青龙面板 多面板时转换一次 并发回写到各面板
+        if len(panels) > 1:  # 多面板
+            logger.info("青龙面板 {0} 个: {1}\n".format(len(panels), ', '.join(panel.name for panel in panels)))  # 标准日志输出
+        converter.api_url = base_url("WSKEY_JD_API_URL", converter.api_url)  # JD 接口地址
+        converter.un_url = base_url("WSKEY_JD_UN_URL", converter.un_url)
+        converter.me_url = base_url("WSKEY_JD_ME_URL", converter.me_url)
+        converter.fixed_cloud_url = os.environ.get("WSKEY_CLOUD_URL") or converter.fixed_cloud_url  # 指定云端地址
+        cloud_ttl = env_num("WSKEY_CLOUD_TTL", 21600)  # 云端地址与参数缓存时间 默认 6 小时
+        refresh_session(cloud_ttl)  # 青龙登录 云端地址与参数
+        update(converter.cloud_arg)  # 调用方法 [update]
+        if "WSKEY_SLEEP" in os.environ and str(os.environ["WSKEY_SLEEP"]).isdigit():  # 判断变量[WSKEY_SLEEP]是否为数字类型
+            sleepTime = int(os.environ["WSKEY_SLEEP"])  # 获取变量 [int]
+        else:  # 判断分支
+            sleepTime = 10  # 默认休眠时间 10秒
+        pacer.interval = sleepTime / workers  # 按主机节流 每个主机每 sleepTime 秒处理 workers 个账号
+        for panel in panels:  # 每处理多少个账号提交一次回写 0 为结束时统一提交
+            panel.writeback.size = max(0, env_num("WSKEY_BATCH_SIZE", 50))
+        pacer.hosts[urlparse(converter.me_url).netloc] = env_num("WSKEY_CHECK_SLEEP", 0.0, float)  # 有效性检查接口单独节流 默认不节流
+        state.open(None if os.environ.get("WSKEY_STATE") == 'disable' or cassette.mode else os.environ.get("WSKEY_STATE") or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'wskey_state.db'))  # 打开账号状态库 默认与脚本同目录
+        jd_backoff.base = max(0.1, env_num("WSKEY_BACKOFF_BASE", 2, float))  # 重试退避初始等待
+        jd_backoff.cap = max(jd_backoff.base, env_num("WSKEY_BACKOFF_CAP", 60, float))  # 重试退避最长等待
+        breaker.threshold = max(1, env_num("WSKEY_BREAKER_THRESHOLD", 5))  # 熔断阈值
+        breaker.cooldown = env_num("WSKEY_BREAKER_COOLDOWN", 600, float)  # 熔断时长
+        breaker.open_until.update(cache.get('breaker', float('inf')) or {})  # 上次运行的熔断状态
+        proxy_pool.load(os.environ.get("WSKEY_PROXIES"))  # 载入 JD 出站代理
+        converter.cloud_interval = env_num("WSKEY_CLOUD_SLEEP", None, float)  # 云端 genToken 请求间隔
+        if proxy_pool.proxies and converter.cloud_interval is None and env_num("WSKEY_PARAMS_TTL", 0) <= 0:  # 云端请求不经代理 仍按默认间隔节流
+            logger.info("genToken 请求不经代理, 按默认间隔节流; 可设置 WSKEY_CLOUD_SLEEP 或 WSKEY_PARAMS_TTL 提高转换速率\n")  # 标准日志输出
+        limiter.maximum = workers  # 自适应并发上限不超过线程数
+        limiter.limit = limiter.shown = max(1, min(workers, env_num("WSKEY_AIMD_START", max(1, workers // 2))))  # 初始并发
+        if env_num("WSKEY_DAEMON", 0, float) > 0:  # 常驻模式
+            run_daemon(env_num("WSKEY_DAEMON", 0, float), workers, cloud_ttl)
+        else:  # 单次执行
+            if hasattr(signal, 'SIGTERM'):  # 定时任务超时 (SIGTERM) 时按正常退出处理 提交已转换的 Cookie
+                signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(128 + signum))
+            run_cycle(workers)
+    except WskeyError as err:  # 中止
+        logger.debug(str(err))  # 调试日志输出
+        sys.exit(err.code)  # 脚本退出
     logger.info("执行完成\n--------------------")  # 标准日志输出
     sys.exit(0)  # 脚本退出
     # Enjoy
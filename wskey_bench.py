@@ -0,0 +1,270 @@
+# -*- coding: utf-8 -*
+# wskey.py 离线基准测试 本地模拟青龙 / 云端 / JD 接口 测量不同账号数下的运行耗时与每账号请求数
+# 用法: python wskey_bench.py --sizes 10,100,1000 --latency 20 --risk-rate 0.05 --env WSKEY_WORKERS=8
+# 代理池: python wskey_bench.py --sizes 100 --proxies 4 --env WSKEY_CHECK_SLEEP=0.2 --env WSKEY_CLOUD_SLEEP=0.05 --env WSKEY_WORKERS=8
+# (模拟接口共用一个主机 主机节流间隔由 WSKEY_CHECK_SLEEP 决定 云端 genToken 间隔由 WSKEY_CLOUD_SLEEP 单独设置)
+
+import argparse  # 命令行参数
+import http.client  # 代理转发
+import json  # 用于Json解析
+import os  # 系统变量
+import random  # 随机延迟/错误
+import re  # 正则过滤
+import subprocess  # 运行 wskey.py
+import sys  # 解释器路径
+import tempfile  # 临时目录
+import threading  # 后台服务
+import time  # 时间
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler  # 本地 HTTP 服务
+from urllib.parse import urlparse, parse_qs  # 解析请求
+
+
+class StandIn:  # 类 模拟接口状态 青龙变量 / 请求计数 / 延迟与错误配置
+    def __init__(self, accounts, args):
+        self.args = args  # 延迟/错误率配置
+        self.random = random.Random(args.seed)  # 固定种子 结果可复现
+        self.lock = threading.Lock()  # 线程锁
+        self.counts = {}  # 路由 -> 请求数
+        self.results = {}  # 转换结果 -> 次数
+        self.envs = []  # 青龙变量
+        self.next_id = accounts + 1  # 新变量 id
+        for i in range(accounts):  # 按比例预置已有 JD_COOKIE
+            if self.random.random() < args.existing:
+                key = 'stale' if self.random.random() < args.invalid_rate else 'valid'  # 已有 Cookie 是否有效
+                self.envs.append({'id': i + 1, 'name': 'JD_COOKIE', 'value': 'pt_key={0}{1};pt_pin=b{1};'.format(key, i), 'status': 0})
+
+    def count(self, route, table=None):  # 方法 计数
+        table = self.counts if table is None else table
+        with self.lock:  # 加锁
+            table[route] = table.get(route, 0) + 1
+
+    def delay(self):  # 方法 模拟网络延迟 (毫秒 + 抖动)
+        latency = self.args.latency + self.random.uniform(0, self.args.jitter)
+        if latency > 0:
+            time.sleep(latency / 1000.0)
+
+    def chance(self, rate):  # 方法 按概率返回 True
+        with self.lock:  # 加锁
+            return self.random.random() < rate
+
+
+def handler(stand):  # 方法 生成绑定模拟状态的请求处理类
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'  # 保持长连接
+
+        def log_message(self, *args):  # 不输出访问日志
+            pass
+
+        def reply(self, code, obj, cookies=()):  # 方法 返回 Json
+            body = json.dumps(obj).encode()
+            self.send_response(code)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            for cookie in cookies:  # Set-Cookie
+                self.send_header('Set-Cookie', cookie)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def handle_any(self):  # 方法 路由
+            url = urlparse(self.path)
+            path, query = url.path, parse_qs(url.query)
+            size = int(self.headers.get('Content-Length') or 0)
+            body = self.rfile.read(size).decode() if size else ''
+            stand.count(self.command + ' ' + path)
+            stand.delay()
+            jd = path in ('/client.action', '/cgi-bin/app/appjmp', '/user_new/info/GetJDUserInfoUnion')  # JD 接口
+            if jd and stand.chance(stand.args.error_rate):  # 模拟接口异常
+                return self.reply(502, {})
+            if path == '/api/user/login':
+                return self.reply(200, {'code': 200, 'data': {'token': 'bench'}})
+            if path == '/api/user':
+                return self.reply(200, {'code': 200, 'data': {}})
+            if path == '/api/envs':
+                return self.envs(body, query)
+            if path in ('/api/envs/enable', '/api/envs/disable'):
+                ids = set(str(i) for i in json.loads(body))
+                with stand.lock:  # 加锁
+                    for env in stand.envs:
+                        if str(env['id']) in ids:
+                            env['status'] = 0 if path.endswith('enable') else 1
+                return self.reply(200, {'code': 200})
+            if path in ('/', '/api/'):
+                return self.reply(200, {})
+            if path == '/api/check_api':
+                return self.reply(200, {'User-Agent': 'okhttp/3.12.1', 'update': 0})
+            if path == '/api/genToken':
+                return self.reply(200, {'functionId': 'genToken', 'sign': 'bench'})
+            if path == '/client.action':
+                pin = re.search(r'pin=([^;]+)', self.headers.get('cookie', '')).group(1)
+                if stand.chance(stand.args.risk_rate):  # 模拟风控
+                    stand.count('risk', stand.results)
+                    return self.reply(200, {'tokenKey': 'xxx'})
+                return self.reply(200, {'tokenKey': 'tk_' + pin})
+            if path == '/cgi-bin/app/appjmp':
+                pin = query['tokenKey'][0][3:]
+                stand.count('ok', stand.results)
+                return self.reply(302, {}, ['pt_key=app_{0}; Path=/'.format(pin), 'pt_pin={0}; Path=/'.format(pin)])
+            if path == '/user_new/info/GetJDUserInfoUnion':
+                cookie = self.headers.get('Cookie', '')
+                return self.reply(200, {'retcode': '1001' if 'pt_key=stale' in cookie else '0'})
+            return self.reply(404, {})
+
+        def envs(self, body, query):  # 方法 青龙变量 查询/更新/新增
+            if self.command == 'GET':
+                value = query.get('searchValue', [''])[0]
+                with stand.lock:  # 加锁
+                    data = [dict(env) for env in stand.envs if value in env['name'] or value in env['value']]
+                return self.reply(200, {'code': 200, 'data': data})
+            data = json.loads(body)
+            with stand.lock:  # 加锁
+                if self.command == 'PUT':  # 更新
+                    for env in stand.envs:
+                        if env['id'] == data['id']:
+                            env['value'] = data['value']
+                    return self.reply(200, {'code': 200, 'data': data})
+                created = []  # 新增
+                for item in data:
+                    env = dict(item, id=stand.next_id, status=0)
+                    stand.next_id += 1
+                    stand.envs.append(env)
+                    created.append(env)
+            return self.reply(200, {'code': 200, 'data': created})
+
+        do_GET = do_POST = do_PUT = handle_any
+
+    return Handler
+
+
+class ProxyStandIn:  # 类 模拟出站代理 转发 http:// 请求到模拟接口 统计经过的请求数
+    def __init__(self):
+        self.lock = threading.Lock()  # 线程锁
+        self.requests = 0  # 转发的请求数
+
+
+def proxy_handler(proxy):  # 方法 生成绑定代理状态的请求处理类
+    class Proxy(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'  # 保持长连接
+
+        def log_message(self, *args):  # 不输出访问日志
+            pass
+
+        def forward(self):  # 方法 转发请求 (绝对地址) 原样返回响应
+            url = urlparse(self.path)
+            size = int(self.headers.get('Content-Length') or 0)
+            body = self.rfile.read(size) if size else None
+            with proxy.lock:  # 加锁
+                proxy.requests += 1
+            headers = {k: v for k, v in self.headers.items() if k.lower() not in ('proxy-connection', 'connection')}
+            conn = http.client.HTTPConnection(url.hostname, url.port, timeout=30)
+            try:  # 异常捕捉
+                conn.request(self.command, url.path + ('?' + url.query if url.query else ''), body=body, headers=headers)
+                res = conn.getresponse()
+                data = res.read()
+            except (OSError, http.client.HTTPException):  # 上游不可用
+                self.send_response(502)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            finally:  # 关闭上游连接
+                conn.close()
+            self.send_response(res.status)
+            for key, value in res.getheaders():  # 原样返回响应头 长度按实际内容
+                if key.lower() not in ('transfer-encoding', 'connection', 'content-length'):
+                    self.send_header(key, value)
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        do_GET = do_POST = do_PUT = forward
+
+    return Proxy
+
+
+def serve(stand, factory=handler):  # 方法 在随机端口启动模拟服务 返回 (server, 地址)
+    server = ThreadingHTTPServer(('127.0.0.1', 0), factory(stand))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, 'http://127.0.0.1:{0}/'.format(server.server_address[1])
+
+
+def run_once(accounts, args):  # 方法 启动模拟服务 运行一次 wskey.py 返回统计 多面板时其他面板只提供青龙接口
+    stands = [StandIn(accounts, args) for _ in range(max(1, args.panels))]
+    servers = [serve(stand) for stand in stands]
+    proxies = [ProxyStandIn() for _ in range(max(0, args.proxies))]  # 模拟代理 JD 接口经代理转发
+    proxy_servers = [serve(proxy, proxy_handler) for proxy in proxies]
+    stand, (_, base) = stands[0], servers[0]
+    with tempfile.TemporaryDirectory() as tmp:
+        auth = os.path.join(tmp, 'auth.json')
+        with open(auth, 'w') as file:
+            json.dump({'username': 'bench', 'password': 'bench', 'token': ''}, file)
+        env = dict(os.environ)
+        env.update({
+            'JD_WSCK': '&'.join('pin=b{0};wskey=w{0};'.format(i) for i in range(accounts)),
+            'WSKEY_QL_URL': base, 'WSKEY_CLOUD_URL': base, 'WSKEY_JD_API_URL': base,
+            'WSKEY_JD_UN_URL': base, 'WSKEY_JD_ME_URL': base, 'WSKEY_AUTH_FILE': auth,
+            'WSKEY_CACHE': 'disable', 'WSKEY_STATE': 'disable', 'WSKEY_SLEEP': '0',
+            'WSKEY_SUMMARY_FILE': os.path.join(tmp, 'summary.json'),
+        })
+        if len(servers) > 1:  # 多面板
+            env['WSKEY_PANELS'] = ' '.join('{0}|{1}'.format(url, auth) for _, url in servers)
+        if proxy_servers:  # 代理池
+            env['WSKEY_PROXIES'] = ','.join(url for _, url in proxy_servers)
+        env.update(dict(item.split('=', 1) for item in args.env))  # 命令行追加的变量
+        script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'wskey.py')
+        start = time.time()
+        proc = subprocess.run([sys.executable, script], env=env, cwd=tmp, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        wall = time.time() - start
+        try:
+            with open(env['WSKEY_SUMMARY_FILE']) as file:
+                phases = json.load(file).get('phase', {})
+        except (OSError, ValueError):
+            phases = {}
+    for item, _ in servers + proxy_servers:  # 关闭模拟服务
+        item.shutdown()
+        item.server_close()
+    if proc.returncode != 0 and args.verbose:
+        sys.stdout.write(proc.stdout.decode(errors='replace'))
+    requests_total = sum(sum(item.counts.values()) for item in stands)  # 全部面板的请求数
+    return {
+        'accounts': accounts, 'panels': len(stands), 'wall': round(wall, 3), 'exit': proc.returncode, 'requests': requests_total,
+        'per_account': round(requests_total / accounts, 2) if accounts else 0, 'routes': stand.counts,
+        'converted': stand.results.get('ok', 0), 'risk': stand.results.get('risk', 0),
+        'phases': {name: item['total'] for name, item in phases.items()},
+        'proxies': [proxy.requests for proxy in proxies],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='wskey.py 离线基准测试')
+    parser.add_argument('--sizes', default='10,100,1000,5000', help='账号数 逗号分隔')
+    parser.add_argument('--latency', type=float, default=20, help='每个请求的模拟延迟 (毫秒)')
+    parser.add_argument('--jitter', type=float, default=10, help='延迟随机抖动上限 (毫秒)')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='JD 接口返回 502 的概率')
+    parser.add_argument('--risk-rate', type=float, default=0.0, help='client.action 返回风控 (tokenKey=xxx) 的概率')
+    parser.add_argument('--existing', type=float, default=0.8, help='已有 JD_COOKIE 的账号比例')
+    parser.add_argument('--invalid-rate', type=float, default=0.5, help='已有 JD_COOKIE 中已失效的比例')
+    parser.add_argument('--panels', type=int, default=1, help='模拟的青龙面板数 (WSKEY_PANELS)')
+    parser.add_argument('--proxies', type=int, default=0, help='模拟的出站代理数 (WSKEY_PROXIES)')
+    parser.add_argument('--seed', type=int, default=1, help='随机种子')
+    parser.add_argument('--env', action='append', default=[], help='传给 wskey.py 的变量 KEY=VALUE 可重复')
+    parser.add_argument('--json', help='结果写入 Json 文件')
+    parser.add_argument('--verbose', action='store_true', help='运行失败时输出 wskey.py 日志')
+    args = parser.parse_args()
+
+    results = []
+    print('{0:>8} {1:>9} {2:>9} {3:>9} {4:>9} {5:>6} {6:>5}  {7}'.format(
+        '账号数', '耗时(秒)', '请求数', '请求/账号', '转换成功', '风控', '退出', '主要阶段(秒)'))
+    for size in [int(i) for i in args.sizes.split(',') if i.strip()]:
+        result = run_once(size, args)
+        results.append(result)
+        top = sorted(result['phases'].items(), key=lambda item: -item[1])[:3]
+        print('{0:>11} {1:>12} {2:>12} {3:>13} {4:>13} {5:>8} {6:>7}  {7}'.format(
+            result['accounts'], result['wall'], result['requests'], result['per_account'], result['converted'],
+            result['risk'], result['exit'], ', '.join('{0} {1}'.format(name, value) for name, value in top)))
+    if args.json:
+        with open(args.json, 'w') as file:
+            json.dump(results, file, ensure_ascii=False, indent=2)
+
+
+if __name__ == '__main__':
+    main()